@@ -0,0 +1,92 @@
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import torch
+
+from chat_model import load_chat_model, default_num_threads
+from session_store import SessionStore, KVCacheStore
+from generation_batcher import GenerationBatcher
+
+MODEL_NAME = "microsoft/DialoGPT-medium"
+# Short multi-turn conversations, replayed identically for every precision
+CONVERSATIONS = [
+    ["Hi there, how are you?", "What do you like to do on weekends?", "Any good movies lately?"],
+    ["Do you like music?", "Who is your favourite band?", "Have you seen them live?"],
+    ["I am planning a trip to Japan.", "What should I see in Tokyo?", "Is it expensive?"],
+    ["What is your favourite food?", "Can you cook?", "What would you make for dinner tonight?"],
+]
+
+
+def current_rss_mb():
+    """ Resident memory of this process right now, from /proc/self/statm (Linux; None elsewhere). Unlike ru_maxrss
+        it drops again once the fp32 weights replaced by quantization are freed."""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+
+
+def run_precision(precision, num_threads, max_new_tokens, seed=0):
+    """ Runs in its own process so the memory figures belong to this precision only."""
+    torch.manual_seed(seed)
+    load_start = time.perf_counter()
+    tokenizer, model = load_chat_model(MODEL_NAME, precision=precision, num_threads=num_threads)
+    load_time = time.perf_counter() - load_start
+    # Drops the fp32 Conv1D weights replaced during quantization before measuring
+    gc.collect()
+    rss_after_load = current_rss_mb()
+
+    sessions = SessionStore(tokenizer.eos_token_id, max_history_tokens=1000 - max_new_tokens)
+    batcher = GenerationBatcher(model, sessions, KVCacheStore(), eos_token_id=tokenizer.eos_token_id,
+                                max_batch_size=1, max_wait=0, max_new_tokens=max_new_tokens)
+    for session, conversation in enumerate(CONVERSATIONS):
+        for message in conversation:
+            batcher.generate(str(session), tokenizer.encode(message + tokenizer.eos_token))
+
+    stats = batcher.stats()
+    return {
+        "precision": precision,
+        "load_seconds": load_time,
+        "generated_tokens": stats["generated_tokens"],
+        "tokens_per_second": stats["tokens_per_second"],
+        "rss_after_load_mb": rss_after_load,
+        "rss_after_generation_mb": current_rss_mb(),
+        # High-water mark, which for int8 includes the fp32 model loaded before quantization; ru_maxrss is in KB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def format_mb(value):
+    return 'n/a' if value is None else f"{value:.0f}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="DialoGPT-medium tokens/s & resident memory, fp32 vs dynamic int8")
+    parser.add_argument('--precisions', nargs='+', default=['fp32', 'int8'])
+    parser.add_argument('--threads', type=int, default=default_num_threads(), help="Intra-op threads")
+    parser.add_argument('--max-new-tokens', type=int, default=64)
+    parser.add_argument('--run', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_precision(args.run, args.threads, args.max_new_tokens)))
+        sys.exit(0)
+
+    print(f"{'precision':<10}{'load s':>10}{'tokens':>10}{'tokens/s':>12}{'RSS loaded MB':>15}{'RSS after gen MB':>18}"
+          f"{'peak RSS MB':>14}")
+    for precision in args.precisions:
+        completed = subprocess.run([sys.executable, __file__, '--run', precision, '--threads', str(args.threads),
+                                    '--max-new-tokens', str(args.max_new_tokens)],
+                                   capture_output=True, text=True, check=True)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        print(f"{precision:<10}{result['load_seconds']:>10.1f}{result['generated_tokens']:>10}"
+              f"{result['tokens_per_second']:>12.1f}{format_mb(result['rss_after_load_mb']):>15}"
+              f"{format_mb(result['rss_after_generation_mb']):>18}{result['peak_rss_mb']:>14.0f}")
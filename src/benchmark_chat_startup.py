@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def request(url, body=None, timeout=60):
+    """ (status code, decoded JSON body), or (None, None) while nothing is listening on the port."""
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'null')
+    except (urllib.error.URLError, ConnectionError):
+        return None, None
+
+
+def measure(port, env, poll_interval=0.05, max_seconds=600):
+    """ Starts chat_app.py & returns the seconds until the port answers, until /ready reports ready & until the
+        first /chat reply is served, all measured from process start."""
+    base_url = f"http://127.0.0.1:{port}"
+    start_time = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'chat_app.py'], cwd=SRC_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        bound, ready = None, None
+        while ready is None:
+            if process.poll() is not None:
+                raise RuntimeError(f"chat_app.py exited with code {process.returncode}")
+            if time.perf_counter() - start_time > max_seconds:
+                raise RuntimeError(f"not ready after {max_seconds}s")
+            status, body = request(f"{base_url}/ready")
+            if status is not None and bound is None:
+                bound = time.perf_counter() - start_time
+            if body and body.get("error"):
+                raise RuntimeError(body["error"])
+            if status == 200:
+                ready = time.perf_counter() - start_time
+            else:
+                time.sleep(poll_interval)
+
+        status, body = request(f"{base_url}/chat", {"message": "Hi, how is it going?", "session_id": "benchmark"})
+        if status != 200:
+            raise RuntimeError(f"/chat answered {status}: {body}")
+        first_reply = time.perf_counter() - start_time
+        return bound, ready, first_reply
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cold start of chat_app.py: time to bind, to ready & to the first reply")
+    parser.add_argument('--runs', type=int, default=3, help="Fresh processes started (median is reported)")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--precision', default='int8', choices=['fp32', 'int8'])
+    parser.add_argument('--snapshot', default=os.path.join(SRC_DIR, 'models', 'DialoGPT-medium'),
+                        help="Local safetensors snapshot (written by the first run if missing)")
+    args = parser.parse_args()
+
+    env = dict(os.environ, CHAT_PORT=str(args.port), CHAT_PRECISION=args.precision,
+               CHAT_MODEL_SNAPSHOT=os.path.abspath(args.snapshot))
+    if not os.path.exists(os.path.join(args.snapshot, 'model.safetensors')):
+        # Not timed: downloads the model & writes the snapshot that the measured runs start from
+        print(f"Creating snapshot in {args.snapshot} ...")
+        measure(args.port, env)
+
+    timings = [measure(args.port, env) for _ in range(args.runs)]
+    bound, ready, first_reply = (statistics.median(values) for values in zip(*timings))
+    print(f"{'port bound s':>14}{'ready s':>10}{'first reply s':>15}")
+    print(f"{bound:>14.2f}{ready:>10.2f}{first_reply:>15.2f}")
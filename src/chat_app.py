@@ -1,53 +1,166 @@
-from flask import Flask, request, jsonify, send_file, abort
+from flask import Flask, Response, request, jsonify, send_file, abort, stream_with_context
 from flask_cors import CORS
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import torch
-import os, json
+import os, json, time, threading, uuid
+from session_store import SessionStore, KVCacheStore
 
 app = Flask(__name__)
 CORS(app)
 
-# Load the DialoGPT model and tokenizer
-model_name = "microsoft/DialoGPT-medium"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForCausalLM.from_pretrained(model_name)
+# Inference settings, overridable through the environment
+# CHAT_PRECISION: 'int8' (dynamic quantization of the transformer's linear layers) or 'fp32'
+PRECISION = os.environ.get("CHAT_PRECISION", "int8")
+# CHAT_NUM_THREADS: intra-op threads (default: every CPU this process may run on)
+NUM_THREADS = int(os.environ["CHAT_NUM_THREADS"]) if os.environ.get("CHAT_NUM_THREADS") else None
+# Reply length & conversation length are capped separately
+MAX_NEW_TOKENS = int(os.environ.get("CHAT_MAX_NEW_TOKENS", 128))
+MAX_HISTORY_TOKENS = int(os.environ.get("CHAT_MAX_HISTORY_TOKENS", 1000 - MAX_NEW_TOKENS))
+# Local safetensors snapshot of the model, written on the first start & memory-mapped on later ones
+MODEL_SNAPSHOT_DIR = os.environ.get("CHAT_MODEL_SNAPSHOT", "./models/DialoGPT-medium")
+PORT = int(os.environ.get("CHAT_PORT", 5000))
 
-# Initialize conversation history
-chat_history_ids = None
+model_name = "microsoft/DialoGPT-medium"
+# The model is loaded by a background thread so the port is bound (& /ready answers) right away;
+# the chat endpoints answer 503 until model_ready is set. torch & transformers are imported by that thread too,
+# which alone takes seconds.
+model_ready = threading.Event()
+startup = {"started_at": time.time(), "error": None}
+tokenizer, model, sessions, kv_cache, batcher = None, None, None, None, None
+
+def load_model():
+    global tokenizer, model, sessions, kv_cache, batcher
+    try:
+        load_start = time.time()
+        from chat_model import load_chat_model, default_num_threads
+        from generation_batcher import GenerationBatcher
+        startup["num_threads"] = NUM_THREADS or default_num_threads()
+        tokenizer, model = load_chat_model(model_name, precision=PRECISION, num_threads=startup["num_threads"],
+                                           snapshot_dir=MODEL_SNAPSHOT_DIR)
+        startup["load_seconds"] = time.time() - load_start
+
+        # GPT-2 has 1024 positions: the history is capped so that history + new message + reply always fit
+        if MAX_HISTORY_TOKENS + MAX_NEW_TOKENS > model.config.n_positions:
+            raise ValueError(f"CHAT_MAX_HISTORY_TOKENS + CHAT_MAX_NEW_TOKENS must be at most {model.config.n_positions}")
+
+        # Conversation history per session (the UI sends a session_id), instead of one history shared by all users
+        sessions = SessionStore(tokenizer.eos_token_id, max_sessions=1000, max_history_tokens=MAX_HISTORY_TOKENS)
+        # Attention keys/values of each session's conversation, so a turn only encodes its new tokens
+        # (about 200 KB per token for DialoGPT-medium, so the budget holds roughly a dozen full-length conversations)
+        kv_cache = KVCacheStore(max_bytes=2 * 1024 ** 3)
+        # Concurrent /chat requests are answered by one batched decode loop
+        batcher = GenerationBatcher(
+            model,
+            sessions,
+            kv_cache,
+            eos_token_id=tokenizer.eos_token_id,
+            max_batch_size=8,
+            max_wait=0.02,
+            max_new_tokens=MAX_NEW_TOKENS,
+            top_k=50,
+            top_p=0.95,
+            temperature=0.7,
+        )
+
+        # One short generation, so the first user does not pay for lazy initialization (thread pools, allocator,
+        # quantized kernels); the warm-up session is forgotten afterwards
+        warmup_start = time.time()
+        batcher.generate("__warmup__", tokenizer.encode("Hello, how are you?" + tokenizer.eos_token))
+        sessions.reset("__warmup__")
+        kv_cache.drop("__warmup__")
+        startup["warmup_seconds"] = time.time() - warmup_start
+        startup["ready_seconds"] = time.time() - startup["started_at"]
+        model_ready.set()
+        print(f"Chat model ready after {startup['ready_seconds']:.1f}s (load {startup['load_seconds']:.1f}s, "
+              f"warm-up {startup['warmup_seconds']:.1f}s)")
+    except Exception as e:
+        startup["error"] = str(e)
+        raise
+
+threading.Thread(target=load_model, name='chat-model-loader', daemon=True).start()
+
+def not_ready_response():
+    error = startup["error"]
+    return jsonify({"error": f"Chat model failed to load: {error}" if error else "Chat model is loading"}), 503
+
+def request_session_id():
+    """ The session_id sent by the client, or a fresh one if it sent none, so clients without a session never share
+        a history (the new id is returned with the reply & continues the conversation). None if it is not a string."""
+    session_id = request.json.get("session_id")
+    if not session_id:
+        return uuid.uuid4().hex
+    return session_id if isinstance(session_id, str) else None
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """ Readiness check: 200 once the model is loaded & warmed up, 503 before that (or if loading failed)."""
+    status = {key: value for key, value in startup.items() if key != "started_at"}
+    status["ready"] = model_ready.is_set()
+    return jsonify(status), 200 if status["ready"] else 503
 
 @app.route('/chat', methods=['POST'])
 def chat():
-    global chat_history_ids
+    if not model_ready.is_set():
+        return not_ready_response()
     user_input = request.json.get("message", "")
+    session_id = request_session_id()
 
     if not isinstance(user_input, str) or not user_input.strip():
         return jsonify({"response": "Invalid input provided!"}), 400
+    if session_id is None:
+        return jsonify({"response": "session_id must be a string"}), 400
 
     # Encode input and generate response
-    new_input_ids = tokenizer.encode(user_input + tokenizer.eos_token, return_tensors="pt")
-    attention_mask = torch.ones(new_input_ids.shape, dtype=torch.long)
-
-    if chat_history_ids is not None:
-        bot_input_ids = torch.cat([chat_history_ids, new_input_ids], dim=-1)
-        attention_mask = torch.cat([torch.ones(chat_history_ids.shape, dtype=torch.long), attention_mask], dim=-1)
-    else:
-        bot_input_ids = new_input_ids
-
-    chat_history_ids = model.generate(
-        bot_input_ids,
-        attention_mask=attention_mask,
-        max_length=1000,
-        pad_token_id=tokenizer.eos_token_id,
-        top_k=50,
-        top_p=0.95,
-        temperature=0.7,
-        do_sample=True,
-    )
-
-    chat_history_ids = chat_history_ids[:, -1000:]
-
-    bot_response = tokenizer.decode(chat_history_ids[:, bot_input_ids.shape[-1]:][0], skip_special_tokens=True)
-    return jsonify({"response": bot_response})
+    new_input_ids = tokenizer.encode(user_input + tokenizer.eos_token)
+    reply_ids = batcher.generate(session_id, new_input_ids)
+
+    bot_response = tokenizer.decode(reply_ids, skip_special_tokens=True)
+    return jsonify({"response": bot_response, "session_id": session_id})
+
+@app.route('/chat_stream', methods=['POST'])
+def chat_stream():
+    """ Same body as /chat, but the reply is streamed as NDJSON while it is generated:
+        {"token": str} for each new piece of decoded text, then {"response": str, "session_id": str,
+        "time_to_first_token": float, "time_taken": float}, or {"error": str} if generation fails."""
+    if not model_ready.is_set():
+        return not_ready_response()
+    user_input = request.json.get("message", "")
+    session_id = request_session_id()
+
+    if not isinstance(user_input, str) or not user_input.strip():
+        return jsonify({"response": "Invalid input provided!"}), 400
+    if session_id is None:
+        return jsonify({"response": "session_id must be a string"}), 400
+
+    new_input_ids = tokenizer.encode(user_input + tokenizer.eos_token)
+
+    def generate():
+        start_time = time.time()
+        time_to_first_token = None
+        reply_ids, sent_text = [], ""
+        try:
+            for token_id in batcher.stream(session_id, new_input_ids):
+                if time_to_first_token is None:
+                    time_to_first_token = time.time() - start_time
+                reply_ids.append(token_id)
+                # BPE tokens are not always whole characters, so the reply is decoded as a whole & only the new
+                # text is sent; an incomplete character (decoded as U+FFFD) waits for the next token
+                text = tokenizer.decode(reply_ids, skip_special_tokens=True)
+                if len(text) > len(sent_text) and not text.endswith('\ufffd'):
+                    yield json.dumps({"token": text[len(sent_text):]}) + '\n'
+                    sent_text = text
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + '\n'
+            return
+        yield json.dumps({"response": tokenizer.decode(reply_ids, skip_special_tokens=True), "session_id": session_id,
+                          "time_to_first_token": time_to_first_token, "time_taken": time.time() - start_time}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/chat_stats', methods=['GET'])
+def chat_stats():
+    if not model_ready.is_set():
+        return not_ready_response()
+    return jsonify({"precision": PRECISION, "num_threads": startup["num_threads"], "sessions": sessions.stats(),
+                    "generation": batcher.stats()})
 
 # Endpoint to save the response data
 @app.route('/saveLog', methods=['POST'])
@@ -107,4 +220,4 @@ def get_log():
         abort(500, description=f"Error reading log file: {str(e)}")
 
 if __name__ == '__main__':
-    app.run(port=5000, host='0.0.0.0')
\ No newline at end of file
+    app.run(port=PORT, host='0.0.0.0')
\ No newline at end of file
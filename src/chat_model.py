@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+
+import torch
+from torch import nn
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers.pytorch_utils import Conv1D
+
+
+def default_num_threads():
+    """ CPUs this process may run on (respects taskset / container CPU limits, unlike os.cpu_count)."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def set_torch_threads(num_threads):
+    """ Pins the intra-op thread pool to num_threads. Inter-op parallelism is not useful for one decode loop, so that
+        pool gets a single thread (it can only be set before torch first uses it)."""
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+
+def conv1d_to_linear(module):
+    """ GPT-2 implements its projections as transformers' Conv1D (weight stored as in x out), which dynamic
+        quantization does not recognize; replaces each one with the equivalent nn.Linear."""
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = nn.Linear(in_features, out_features)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            conv1d_to_linear(child)
+    return module
+
+
+def has_snapshot(snapshot_dir):
+    return snapshot_dir is not None and os.path.exists(os.path.join(snapshot_dir, 'model.safetensors'))
+
+
+def save_snapshot(tokenizer, model, snapshot_dir):
+    """ Writes the tokenizer & weights to a temporary sibling directory & renames it to snapshot_dir once complete,
+        so an interrupted save never leaves a snapshot that has_snapshot would accept. If snapshot_dir already
+        exists (another process finished first, or a leftover directory), it is kept & the new copy is dropped."""
+    snapshot_dir = os.path.abspath(snapshot_dir)
+    parent_dir = os.path.dirname(snapshot_dir)
+    os.makedirs(parent_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=os.path.basename(snapshot_dir) + '.tmp-', dir=parent_dir)
+    try:
+        tokenizer.save_pretrained(temp_dir)
+        model.save_pretrained(temp_dir, safe_serialization=True)
+        if not has_snapshot(snapshot_dir):
+            os.replace(temp_dir, snapshot_dir)
+    except OSError as e:
+        print(f"Could not save the model snapshot to {snapshot_dir}: {e}")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def load_chat_model(model_name, precision='int8', num_threads=None, snapshot_dir=None):
+    """ Tokenizer & model for CPU inference. With precision='int8' the linear layers of the transformer blocks get
+        dynamic int8 quantization (int8 weights, activations quantized on the fly); the output layer, which shares its
+        weights with the token embeddings, stays in fp32.
+        With snapshot_dir, the tokenizer & fp32 weights are read from that local directory (weights as
+        model.safetensors, which is memory-mapped instead of unpickled), without contacting the model hub. If the
+        snapshot does not exist yet, the model is loaded from the hub once & saved there (see save_snapshot)."""
+    if precision not in ('fp32', 'int8'):
+        raise ValueError(f"Unknown precision {precision!r}, expected 'fp32' or 'int8'")
+    set_torch_threads(num_threads or default_num_threads())
+
+    if has_snapshot(snapshot_dir):
+        tokenizer = AutoTokenizer.from_pretrained(snapshot_dir, local_files_only=True)
+        # low_cpu_mem_usage skips the random initialization that would be overwritten by the snapshot anyway
+        model = AutoModelForCausalLM.from_pretrained(snapshot_dir, local_files_only=True, low_cpu_mem_usage=True)
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForCausalLM.from_pretrained(model_name)
+        if snapshot_dir is not None:
+            save_snapshot(tokenizer, model, snapshot_dir)
+    model.eval()
+    if precision == 'int8':
+        conv1d_to_linear(model.transformer)
+        torch.quantization.quantize_dynamic(model.transformer, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return tokenizer, model
@@ -23,6 +23,11 @@ const ChatWindow = () => {
   const [mode, setMode] = useState("Retrieval"); // Toggle mode state
 
   const [selectedTopics, setSelectedTopics] = useState([]); // Selected topics state
+  // Identifies this conversation to the chat service, which keeps one history per session
+  // (crypto.randomUUID is not available on plain http pages)
+  const [sessionId] = useState(
+    () => `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+  );
 
   // List of topics for the checkboxes
   const topicsList = [
@@ -50,6 +55,29 @@ const ChatWindow = () => {
       return false;
     }
   }
+  // Posts to /chat_stream & calls onLine with each NDJSON line as soon as it arrives
+  const streamChat = async (message, onLine) => {
+    const response = await fetch("http://34.68.123.1:5000/chat_stream", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ message, session_id: sessionId }),
+    });
+    if (!response.ok || !response.body) throw new Error(`Chat request failed: ${response.status}`);
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = "";
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffered += decoder.decode(value, { stream: true });
+      const lines = buffered.split("\n");
+      buffered = lines.pop(); // Keep the incomplete last line for the next chunk
+      lines.filter((line) => line.trim()).forEach((line) => onLine(JSON.parse(line)));
+    }
+    if (buffered.trim()) onLine(JSON.parse(buffered));
+  };
+
   const handleSendMessage = async () => {
     if (!input.trim()) return;
   
@@ -65,19 +93,25 @@ const ChatWindow = () => {
       const userInput = userMessage.text;
   
       if (mode === "ChitChat") {
-        // Directly call ChitChat API
+        // Directly call ChitChat API, rendering the reply as its tokens arrive
         console.log("ChitChat Mode Active");
-        const chitchatResponse = await axios.post("http://34.68.123.1:5000/chat", {
-          message: userInput,
-        });
-        const botMessage = {
-          text: `ChitChat: ${chitchatResponse.data?.response || "No response received."}\n`,
-          sender: "bot",
+        let replyText = "";
+        const showReply = (text) => {
+          setMessages((prevMessages) => {
+            const updatedMessages = [...prevMessages];
+            updatedMessages.pop(); // Replace the loading message / previous partial reply
+            return [...updatedMessages, { text: `ChitChat: ${text}\n`, sender: "bot" }];
+          });
         };
-        setMessages((prevMessages) => {
-          const updatedMessages = [...prevMessages];
-          updatedMessages.pop(); // Remove loading message
-          return [...updatedMessages, botMessage];
+        await streamChat(userInput, (line) => {
+          if (line.error) throw new Error(line.error);
+          if (line.token !== undefined) {
+            replyText += line.token;
+            showReply(replyText);
+          } else if (line.response !== undefined) {
+            console.log("ChitChat time to first token:", line.time_to_first_token);
+            showReply(line.response || "No response received.");
+          }
         });
         return; // Exit function since ChitChat is handled
       }
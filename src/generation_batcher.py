@@ -0,0 +1,230 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+try:
+    from transformers import DynamicCache
+except ImportError:
+    DynamicCache = None
+
+
+def sample_next_tokens(logits, top_k=50, top_p=0.95, temperature=0.7):
+    """ One sampled token id per row of logits, with the same temperature -> top-k -> top-p (nucleus) filtering
+        as model.generate(do_sample=True)."""
+    logits = logits / temperature
+    if top_k:
+        kth_best = torch.topk(logits, min(top_k, logits.size(-1))).values[:, -1:]
+        logits = logits.masked_fill(logits < kth_best, float('-inf'))
+    if top_p < 1.0:
+        sorted_logits, sorted_indices = torch.sort(logits, descending=True)
+        cumulative_probs = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+        # Drop the tokens after the smallest set whose probability reaches top_p (always keeping the best one)
+        remove = cumulative_probs > top_p
+        remove[:, 1:] = remove[:, :-1].clone()
+        remove[:, 0] = False
+        logits = logits.scatter(1, sorted_indices, sorted_logits.masked_fill(remove, float('-inf')))
+    return torch.multinomial(logits.softmax(dim=-1), num_samples=1).squeeze(1)
+
+
+def to_legacy_cache(past_key_values):
+    if hasattr(past_key_values, 'to_legacy_cache'):
+        return past_key_values.to_legacy_cache()
+    return past_key_values
+
+
+def to_model_cache(past_key_values):
+    if DynamicCache is not None:
+        return DynamicCache.from_legacy_cache(past_key_values)
+    return past_key_values
+
+
+class GenerationBatcher:
+    """ Answers concurrent chat turns with one batched decode loop.
+        A single worker thread owns the model: it takes the first waiting turn, waits up to max_wait seconds for
+        more (at most max_batch_size) & generates the replies together. Each session's past_key_values are kept in
+        kv_cache, so a turn only encodes the tokens added since the cached prefix (the previous reply's last token
+        & the new message) instead of the whole conversation.
+        Rows are left-padded in two places, before the cached keys/values & before the new tokens, with the padding
+        masked out & explicit position ids, so every row sees exactly the positions it would see on its own.
+        When the history is cut to fit max_history_tokens, the cached entry no longer matches the history (GPT-2
+        positions are absolute) and is dropped; the kept turns are re-encoded from position 0. The session store cuts
+        down to its low-water mark, so a long conversation pays for that once every few turns, not on every turn."""
+    def __init__(self, model, sessions, kv_cache, eos_token_id, max_batch_size=8, max_wait=0.02, max_new_tokens=128,
+                 top_k=50, top_p=0.95, temperature=0.7):
+        self.model = model
+        self.sessions = sessions
+        self.kv_cache = kv_cache
+        self.eos_token_id = eos_token_id
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_new_tokens = max_new_tokens
+        self.sampling = {"top_k": top_k, "top_p": top_p, "temperature": temperature}
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches, self.requests, self.generated_tokens, self.prompt_tokens = 0, 0, 0, 0
+        self.total_generate_time = 0.0
+
+        self._thread = threading.Thread(target=self._run, name='generation-batcher', daemon=True)
+        self._thread.start()
+
+    def generate(self, session_id, new_input_ids, on_token=None):
+        """ Blocks until the reply to the session's new message (token ids ending with eos) is generated & returns
+            its token ids, ending with the eos token unless the reply was cut at max_new_tokens.
+            on_token, if given, is called with each reply token id as soon as it is sampled (on the worker thread,
+            so it must not block)."""
+        future = Future()
+        self._queue.put((session_id, new_input_ids, on_token, future))
+        return future.result()
+
+    def stream(self, session_id, new_input_ids):
+        """ Like generate, but yields the reply token ids one at a time while the batch is still decoding."""
+        tokens = queue.Queue()
+        future = Future()
+        future.add_done_callback(lambda done: tokens.put(None))
+        self._queue.put((session_id, new_input_ids, tokens.put, future))
+        while True:
+            token = tokens.get()
+            if token is None:
+                break
+            yield token
+        # Re-raises a failed generation
+        future.result()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "prompt_tokens_encoded": self.prompt_tokens,
+                "generated_tokens": self.generated_tokens,
+                "tokens_per_second": self.generated_tokens / self.total_generate_time if self.total_generate_time else 0.0,
+                "queued": self._queue.qsize(),
+                "kv_cache": self.kv_cache.stats(),
+            }
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                with torch.inference_mode():
+                    replies = self._generate_batch([turn[:3] for turn in batch])
+            except Exception as e:
+                for session_id, new_input_ids, on_token, future in batch:
+                    future.set_exception(e)
+                continue
+            for (session_id, new_input_ids, on_token, future), reply in zip(batch, replies):
+                future.set_result(reply)
+
+    def _prepare_row(self, session_id, new_input_ids):
+        """ (prompt ids, cached past or None, number of prompt tokens the past covers) for one turn."""
+        prompt = self.sessions.get(session_id) + new_input_ids
+        truncated = self.sessions.truncate(prompt)
+        if len(truncated) < len(prompt):
+            self.kv_cache.drop(session_id)
+            return truncated, None, 0
+        past, cached_length = self.kv_cache.get(session_id, prompt)
+        # At least one token has to be fed to get the logits of the next one
+        if cached_length >= len(prompt):
+            return prompt, None, 0
+        return prompt, past, cached_length
+
+    def _generate_batch(self, turns):
+        rows = [self._prepare_row(session_id, new_input_ids) for session_id, new_input_ids, on_token in turns]
+        callbacks = [on_token for session_id, new_input_ids, on_token in turns]
+        batch_size = len(rows)
+        past_length = max(cached_length for prompt, past, cached_length in rows)
+        feed_length = max(len(prompt) - cached_length for prompt, past, cached_length in rows)
+
+        # Layout of row i: [padding][its cached keys/values][padding][its uncached prompt tokens]
+        input_ids = torch.full((batch_size, feed_length), self.eos_token_id, dtype=torch.long)
+        position_ids = torch.zeros((batch_size, feed_length), dtype=torch.long)
+        attention_mask = torch.zeros((batch_size, past_length + feed_length), dtype=torch.long)
+        for row, (prompt, past, cached_length) in enumerate(rows):
+            feed = prompt[cached_length:]
+            input_ids[row, feed_length - len(feed):] = torch.tensor(feed, dtype=torch.long)
+            position_ids[row, feed_length - len(feed):] = torch.arange(cached_length, len(prompt))
+            attention_mask[row, past_length - cached_length:past_length] = 1
+            attention_mask[row, past_length + feed_length - len(feed):] = 1
+        past_key_values = self._pad_past(rows, past_length) if past_length else None
+
+        start_time = time.perf_counter()
+        replies = [[] for _ in rows]
+        finished = torch.zeros(batch_size, dtype=torch.bool)
+        next_positions = torch.tensor([len(prompt) for prompt, past, cached_length in rows], dtype=torch.long)
+        for step in range(self.max_new_tokens):
+            outputs = self.model(input_ids=input_ids, past_key_values=past_key_values, attention_mask=attention_mask,
+                                 position_ids=position_ids, use_cache=True)
+            past_key_values = outputs.past_key_values
+            next_tokens = sample_next_tokens(outputs.logits[:, -1, :], **self.sampling)
+            for row, token in enumerate(next_tokens.tolist()):
+                if not finished[row]:
+                    replies[row].append(token)
+                    if callbacks[row] is not None:
+                        callbacks[row](token)
+            finished |= next_tokens == self.eos_token_id
+            if bool(finished.all()) or step == self.max_new_tokens - 1:
+                break
+            # Finished rows keep running with their new tokens masked out, so their cache stays exact
+            input_ids = next_tokens.unsqueeze(1)
+            position_ids = next_positions.unsqueeze(1)
+            next_positions = next_positions + 1
+            attention_mask = torch.cat([attention_mask, (~finished).long().unsqueeze(1)], dim=1)
+        generate_time = time.perf_counter() - start_time
+
+        past_key_values = to_legacy_cache(past_key_values)
+        for row, ((session_id, new_input_ids, on_token), (prompt, past, cached_length)) in enumerate(zip(turns, rows)):
+            history = prompt + replies[row]
+            stored_history = self.sessions.truncate(history)
+            if len(stored_history) == len(history):
+                # The reply's last token has not been fed to the model yet, so the cache covers everything before it
+                covered = attention_mask[row].nonzero().squeeze(1)
+                self.kv_cache.put(session_id, history[:-1], tuple(
+                    (key[row:row + 1, :, covered, :], value[row:row + 1, :, covered, :])
+                    for key, value in past_key_values))
+            else:
+                self.kv_cache.drop(session_id)
+            self.sessions.put(session_id, stored_history)
+
+        with self._lock:
+            self.batches += 1
+            self.requests += len(rows)
+            self.prompt_tokens += sum(len(prompt) - cached_length for prompt, past, cached_length in rows)
+            self.generated_tokens += sum(len(reply) for reply in replies)
+            self.total_generate_time += generate_time
+        return replies
+
+    @staticmethod
+    def _pad_past(rows, past_length):
+        """ Left-pads each row's cached keys/values to past_length & stacks them into one batch cache."""
+        template = next(past for prompt, past, cached_length in rows if past is not None)
+        layers = []
+        for layer, (template_key, template_value) in enumerate(template):
+            keys, values = [], []
+            for prompt, past, cached_length in rows:
+                key = template_key.new_zeros(template_key.shape[:2] + (past_length,) + template_key.shape[3:])
+                value = template_value.new_zeros(template_value.shape[:2] + (past_length,) + template_value.shape[3:])
+                if past is not None:
+                    key[:, :, past_length - cached_length:] = past[layer][0]
+                    value[:, :, past_length - cached_length:] = past[layer][1]
+                keys.append(key)
+                values.append(value)
+            layers.append((torch.cat(keys), torch.cat(values)))
+        return to_model_cache(tuple(layers))
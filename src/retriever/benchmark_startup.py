@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RETRIEVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Code run in a fresh interpreter for every measurement. Network access is turned into an error, so a service that
+# still downloads something at start-up fails the benchmark instead of looking slow.
+CHILD_TEMPLATE = '''
+import json, socket, sys, time
+start_time = time.perf_counter()
+
+def offline(*args, **kwargs):
+    raise OSError("network access during start-up")
+socket.socket.connect = offline
+
+sys.path.insert(0, {service_dir!r})
+{setup}
+print(json.dumps({{"import_seconds": time.perf_counter() - start_time, "nltk_loaded": "nltk" in sys.modules}}))
+'''
+
+
+def services(segment_path):
+    daat_setup = 'import server'
+    if segment_path:
+        daat_setup += ('\nserver.boolean_retrieval_runner = server.BooleanRetrievalRunner(postings_cls=server.ArrayPostingsList)'
+                       f'\nserver.boolean_retrieval_runner.load_index({os.path.abspath(segment_path)!r})')
+    return {
+        "retriever_server.py": (os.path.join(RETRIEVER_DIR, 'solr_retriever'), 'import retriever_server'),
+        "async_retriever_server.py": (os.path.join(RETRIEVER_DIR, 'solr_retriever'), 'import async_retriever_server'),
+        "DaaT/server.py": (os.path.join(RETRIEVER_DIR, 'indexer', 'DaaT'), daat_setup),
+    }
+
+
+def measure(service_dir, setup, work_dir):
+    """ Wall time of a fresh interpreter importing & setting up the service (everything before app.run)."""
+    code = CHILD_TEMPLATE.format(service_dir=service_dir, setup=setup)
+    start_time = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', code], cwd=work_dir, capture_output=True, text=True)
+    wall_time = time.perf_counter() - start_time
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    return wall_time, result["import_seconds"], result["nltk_loaded"]
+
+
+def run_benchmark(runs, segment_path):
+    print(f"{'service':<28}{'cold start s':>14}{'import s':>12}{'nltk loaded':>14}")
+    # Archives & other files the services create at start-up go to a scratch directory
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, (service_dir, setup) in services(segment_path).items():
+            try:
+                timings = [measure(service_dir, setup, work_dir) for _ in range(runs)]
+            except RuntimeError as e:
+                print(f"{name:<28}failed: {e}")
+                continue
+            wall_times, import_times, nltk_loaded = zip(*timings)
+            print(f"{name:<28}{statistics.median(wall_times):>14.3f}{statistics.median(import_times):>12.3f}"
+                  f"{str(any(nltk_loaded)):>14}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cold start time of the retriever services, with network access disabled")
+    parser.add_argument('--runs', type=int, default=5, help="Fresh interpreters started per service (median is reported)")
+    parser.add_argument('--segment', default=None, help="DaaT index segment to load, as DaaT/server.py does on start-up")
+    args = parser.parse_args()
+
+    run_benchmark(args.runs, args.segment)
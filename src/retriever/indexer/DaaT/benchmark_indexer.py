@@ -0,0 +1,44 @@
+import argparse
+import time
+
+from indexer import Indexer
+from postings import ArrayPostingsList
+from preprocessor import Preprocessor
+
+
+def legacy_generate_inverted_index(indexer, doc_id, tokenized_document):
+    """ Previous indexing path: one Counter over the whole document per unique token."""
+    doc_length = len(tokenized_document)
+    for token in set(tokenized_document):
+        token_freq = Preprocessor.get_token_freq(token, tokenized_document)
+        indexer.add_to_index(token, doc_id, token_freq, doc_length)
+
+
+def time_per_document(index_document, preprocessed_data):
+    indexer = Indexer(postings_cls=ArrayPostingsList)
+    start_time = time.perf_counter()
+    for doc_id, tokens in preprocessed_data:
+        index_document(indexer, doc_id, tokens)
+    return (time.perf_counter() - start_time) / max(len(preprocessed_data), 1)
+
+
+def run_benchmark(corpus_path, limit=None):
+    preprocessed_data = Preprocessor().preprocess_2(corpus_path)[:limit]
+    total_tokens = sum(len(tokens) for _, tokens in preprocessed_data)
+    print(f"{len(preprocessed_data)} docs, {total_tokens / max(len(preprocessed_data), 1):.1f} tokens per doc on average")
+
+    legacy_cost = time_per_document(legacy_generate_inverted_index, preprocessed_data)
+    single_pass_cost = time_per_document(Indexer.generate_inverted_index, preprocessed_data)
+
+    print(f"Per-token Counter (legacy): {legacy_cost * 1e6:.1f} us/doc")
+    print(f"Single pass counts:         {single_pass_cost * 1e6:.1f} us/doc")
+    print(f"Speed-up: {legacy_cost / single_pass_cost:.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Per-document cost of building the inverted index")
+    parser.add_argument('--corpus', default='./corpus/corpus_main.txt', help="Corpus file written by CorpusCreator")
+    parser.add_argument('--limit', type=int, default=None, help="Only index the first N documents")
+    args = parser.parse_args()
+
+    run_benchmark(args.corpus, args.limit)
@@ -1,17 +1,56 @@
 from indexer import Indexer
 from preprocessor import Preprocessor
 from linkedlist import LinkedList, Node
+from intersection import intersect_postings
 
 from tqdm import tqdm
 import heapq
 import sys
 import random
 import json
+from bisect import bisect_left
+
+
+class TermScoreCursor:
+    """ Cursor over one query term's postings used by block-max WAND. Holds the doc ids, tf-idf scores and
+        the per-block / per-term tf-idf upper bounds pre-computed by Indexer.calculate_tf_idf.
+        Stored scores & bounds are multiplied by scale (see Indexer.get_live_segments)."""
+    def __init__(self, postings_list, scale=1.0):
+        self.doc_ids, self.tf_idfs = postings_list.score_columns()
+        self.scale = scale
+        self.block_size = postings_list.block_size
+        self.block_max = postings_list.block_max
+        self.max_score = postings_list.max_tf_idf * scale
+        self.length = len(self.doc_ids)
+        self.position = 0
+        self.block = 0
+
+    @property
+    def doc_id(self):
+        return self.doc_ids[self.position] if self.position < self.length else None
+
+    @property
+    def score(self):
+        return self.tf_idfs[self.position] * self.scale
+
+    def advance(self, target):
+        """ Moves to the first posting with doc id >= target."""
+        self.position = bisect_left(self.doc_ids, target, self.position, self.length)
+
+    def block_upper_bound(self, target):
+        """ Shallow move to the block that could contain target (without decoding postings) & return its max tf-idf."""
+        while self.block < len(self.block_max) and self.block_last_doc_id() < target:
+            self.block += 1
+        return self.block_max[self.block] * self.scale if self.block < len(self.block_max) else 0.0
+
+    def block_last_doc_id(self):
+        return self.doc_ids[min((self.block + 1) * self.block_size, self.length) - 1]
+
 
 class BooleanRetrievalRunner:
-    def __init__(self):
+    def __init__(self, postings_cls=LinkedList):
         self.preprocessor = Preprocessor()
-        self.indexer = Indexer() 
+        self.indexer = Indexer(postings_cls=postings_cls)
 
     def _merge(self, results=None, daats=True, key_name=None):
         """ Implement the merge algorithm to merge 2 postings list at a time.
@@ -140,82 +179,49 @@ class BooleanRetrievalRunner:
         return res
 
 
-    def _merge_intersection_skip(self, head_posting1, head_posting2, use_tf_idf=False):
-        if not head_posting1 or not head_posting2:
-            return []
-
-        head1 = head_posting1
-        head2 = head_posting2
-
-        result = []
-        num_comparisons = 0
-
-        while head1 and head2:
-            num_comparisons += 1
-            if head1.value[0] == head2.value[0]:
-                if use_tf_idf:
-                    result.append((head1.value[0], head1.value[3]))
-                else:
-                    result.append(head1.value[0])
-                head1 = head1.next
-                head2 = head2.next
-            elif head1.value[0] < head2.value[0]:
-                if head1.skip and head1.skip.value[0] <= head2.value[0]:
-                    head1 = head1.skip
-                else:
-                    head1 = head1.next
-            else:
-                if head2.skip and head2.skip.value[0] <= head1.value[0]:
-                    head2 = head2.skip
-                else:
-                    head2 = head2.next
-
-        if use_tf_idf:
-            result.sort(key=lambda x: x[1], reverse=True)
-        return result, num_comparisons
-    
-    
     def _daat_and_skip_intersect(self, retrieved_postings_list, original_query_term, query_terms, use_tf_idf=False):
-        postings_list_key = 'postingsListSkip'
-        postings_lists = retrieved_postings_list[postings_list_key]
-
-        # print(postings_lists, 'Inside DAAT AND SKIP INTERSECT')
+        """ DAAT AND over all query terms in a single pass, shortest postings list first. Each pair is intersected
+            with a linear merge, skip pointers or galloping search depending on their length ratio
+            (see intersection.py). num_comparisons counts doc id comparisons between postings, as in _daat_and."""
+        terms = list(retrieved_postings_list['postingsListSkip'].keys())
 
-        postings_lists = dict(sorted(postings_lists.items(), key=lambda item: len(item[1])))
-        
+        query_terms_key = ' '.join(original_query_term)
 
-        # if not postings_lists or len(postings_lists) < len(query_terms):
-        #     return [], 0
+        result_key = 'daatAnd'
 
-        num_comparisons = 0
-        
-        res = postings_lists[query_terms[0]]
+        result = {result_key: {query_terms_key: {'results': [], 'num_comparisons': 0, 'num_docs': 0}}}
 
-        postings_list_heads = [ retrieved_postings_list['head'][term] for term in postings_lists ]
+        if not terms:
+            return result
 
-        num_comparisons = {term: 0 for term in postings_lists}
+        # Each segment of the live index holds different documents, so the intersection runs per segment
+        segments = self.indexer.get_live_segments(terms)
+        # Merge order optimization: shortest postings list first (by live length, the same order in every segment)
+        doc_freqs = {term: sum(postings[term].length for postings, scales, deleted in segments
+                               if postings[term] is not None) for term in terms}
+        terms = sorted(dict.fromkeys(terms), key=lambda term: doc_freqs[term])
 
-        query_terms_key = ' '.join(original_query_term)
+        matches = []
+        for postings, scales, deleted in segments:
+            if any(postings[term] is None for term in terms):
+                continue
+            score_columns = [postings[term].score_columns() for term in terms]
 
-        # result_key = 'daatAndSkip' if not use_tf_idf else 'daatAndSkipTfIdf'
-        result_key = 'daatAnd'
+            positions, num_comparisons = intersect_postings(
+                [(doc_ids, postings[term].skip_length) for (doc_ids, _), term in zip(score_columns, terms)])
+            result[result_key][query_terms_key]['num_comparisons'] += num_comparisons
 
-        result = {result_key: {query_terms_key: {'results': [], 'num_comparisons': 0, 'num_docs': 0}}}
+            shortest_doc_ids, shortest_tf_idfs = score_columns[0]
+            matches.extend((shortest_doc_ids[position], shortest_tf_idfs[position] * scales[terms[0]])
+                           for position in positions if deleted is None or shortest_doc_ids[position] not in deleted)
 
-        for i in range(len(postings_list_heads) - 1):
-            res_array, num_compares = self._merge_intersection_skip(postings_list_heads[i], postings_list_heads[i + 1], use_tf_idf)
-            result[result_key][query_terms_key]['results'] = res_array
-            result[result_key][query_terms_key]['num_comparisons']  = num_compares
-            result[result_key][query_terms_key]['num_docs'] = len(res_array)
-            num_comparisons[query_terms[i]] = num_compares
-            if not res:
-                break
-            # num_comparisons += 1
+        matches.sort()
         if use_tf_idf:
-            result[result_key][query_terms_key]['results'] = [doc_id for doc_id, _ in result[result_key][query_terms_key]['results']]
-        return result
+            matches.sort(key=lambda match: match[1], reverse=True)
 
- 
+        result[result_key][query_terms_key]['results'] = [doc_id for doc_id, tf_idf in matches]
+        result[result_key][query_terms_key]['num_docs'] = len(matches)
+        return result
 
     def _daat_and(self, retrieved_postings_list, original_query ,use_skip=False ,use_tf_idf=False):
         """ Implement the DAAT AND algorithm, which merges the postings list of N query terms.
@@ -265,7 +271,6 @@ class BooleanRetrievalRunner:
 
             docs_matched = True
 
-            res['daatAnd'][query_terms_key]['num_comparisons'] += 1
             # print("MIN DOC ID", min_doc_id)
             # print("heap after pop", min_heap)
 
@@ -301,6 +306,10 @@ class BooleanRetrievalRunner:
                 
                 doc_id = term_postings_list[term_pointer][0] if use_tf_idf else term_postings_list[term_pointer]
 
+                # num_comparisons counts doc id comparisons between postings (the same unit as _daat_and_skip_intersect)
+                if term_pointer < ending_ptrs[term]:
+                    res['daatAnd'][query_terms_key]['num_comparisons'] += 1
+
                 if term_pointer < ending_ptrs[term] and doc_id == min_doc_id:
                     # print("INSIDE THE IF of exact match", term_postings_list[term_pointer], min_doc_id)
                     # res['daatAnd'][query_terms_key]['num_comparisons'] += 1
@@ -360,24 +369,111 @@ class BooleanRetrievalRunner:
         return res
        
 
+    def _block_max_wand(self, cursors, k, deleted=None):
+        """ Disjunctive top-k retrieval with block-max WAND. A document is only scored when the sum of the term
+            upper bounds, and then of the block upper bounds, of the cursors up to the pivot can beat the current
+            k-th best score; otherwise whole blocks are skipped. Doc ids in deleted are never scored.
+            Returns the top-k (score, doc_id) pairs & the number of documents that were fully scored."""
+        top_k = []
+        threshold = 0.0
+        num_scored = 0
+        cursors = [cursor for cursor in cursors if cursor.length]
+
+        while cursors:
+            cursors.sort(key=lambda cursor: cursor.doc_id)
+
+            # Pivot: first cursor where the accumulated term upper bounds can beat the threshold
+            upper_bound, pivot = 0.0, None
+            for i, cursor in enumerate(cursors):
+                upper_bound += cursor.max_score
+                if upper_bound > threshold:
+                    pivot = i
+                    break
+            if pivot is None:
+                break
+
+            pivot_doc_id = cursors[pivot].doc_id
+            while pivot + 1 < len(cursors) and cursors[pivot + 1].doc_id == pivot_doc_id:
+                pivot += 1
+
+            block_upper_bound = sum(cursor.block_upper_bound(pivot_doc_id) for cursor in cursors[:pivot + 1])
+
+            if block_upper_bound > threshold:
+                if cursors[0].doc_id == pivot_doc_id and deleted is not None and pivot_doc_id in deleted:
+                    for cursor in cursors[:pivot + 1]:
+                        cursor.advance(pivot_doc_id + 1)
+                elif cursors[0].doc_id == pivot_doc_id:
+                    score = 0.0
+                    for cursor in cursors[:pivot + 1]:
+                        score += cursor.score
+                        cursor.advance(pivot_doc_id + 1)
+                    num_scored += 1
+
+                    if len(top_k) < k:
+                        heapq.heappush(top_k, (score, pivot_doc_id))
+                    elif score > top_k[0][0]:
+                        heapq.heapreplace(top_k, (score, pivot_doc_id))
+                    if len(top_k) == k:
+                        threshold = top_k[0][0]
+                else:
+                    # Bring a lagging cursor up to the pivot document
+                    cursors[0].advance(pivot_doc_id)
+            else:
+                # No document in the current blocks can make it into the top-k, jump past the shortest block
+                next_doc_id = min(cursor.block_last_doc_id() for cursor in cursors[:pivot + 1]) + 1
+                if pivot + 1 < len(cursors):
+                    next_doc_id = min(next_doc_id, cursors[pivot + 1].doc_id)
+                next_doc_id = max(next_doc_id, pivot_doc_id + 1)
+                max(cursors[:pivot + 1], key=lambda cursor: cursor.max_score).advance(next_doc_id)
+
+            cursors = [cursor for cursor in cursors if cursor.doc_id is not None]
+
+        return sorted(top_k, reverse=True), num_scored
+
+    def run_ranked_query(self, query, original_query, k=10):
+        """ Ranked (disjunctive) retrieval of the top-k documents for a tokenized query, scored by the sum of
+            the tf-idf of the matching query terms. Latency is bounded by k through block-max WAND pruning
+            instead of by the postings lengths."""
+        top_k, num_scored = [], 0
+        if k < 1:
+            # Nothing to rank; the pruning threshold is only defined once the top-k heap has an entry
+            return self._ranked_response(original_query, top_k, num_scored)
+        # Each segment of the live index holds different documents, so their top-k lists are simply combined
+        for postings, scales, deleted in self.indexer.get_live_segments(set(query)):
+            cursors = [TermScoreCursor(postings_list, scales[term]) for term, postings_list in postings.items()
+                       if postings_list is not None]
+            segment_top_k, segment_scored = self._block_max_wand(cursors, k, deleted)
+            top_k.extend(segment_top_k)
+            num_scored += segment_scored
+        top_k = heapq.nlargest(k, top_k)
+        return self._ranked_response(original_query, top_k, num_scored)
+
+    @staticmethod
+    def _ranked_response(original_query, top_k, num_scored):
+        query_terms_key = ' '.join(original_query) if isinstance(original_query, list) else original_query
+        return {'topK': {query_terms_key: {'results': [doc_id for score, doc_id in top_k],
+                                           'scores': [score for score, doc_id in top_k],
+                                           'num_scored': num_scored,
+                                           'num_docs': len(top_k)}}}
+
     def get_postings(self, query, use_skip=False, get_tf_idf=False):
         """ Function to get the postings list of a term from the index.
             Use appropriate parameters & return types.
             To be implemented."""
         inverted_index_key = 'postingsList' if not use_skip else 'postingsListSkip'
         res = {inverted_index_key: {}, 'head': {}}
-        inverted_index = self.indexer.get_index()
         for term in query:
-            if term not in inverted_index:
+            postings_list = self.indexer.get_term_postings(term)
+            if postings_list is None:
                 res[inverted_index_key][term] = []
                 res['head'][term] = None
             else:
                 if not use_skip:
-                    term_docs, list_head = inverted_index[term].traverse_list()
+                    term_docs, list_head = postings_list.traverse_list()
                     res['head'][term] = list_head
                 else:
-                    term_docs, list_head = inverted_index[term].traverse_list()
-                    term_docs = inverted_index[term].traverse_skips()
+                    term_docs, list_head = postings_list.traverse_list()
+                    term_docs = postings_list.traverse_skips()
                     res['head'][term] = list_head
                 
                 res[inverted_index_key][term] = [(doc_id, tf_idf) if get_tf_idf else doc_id for doc_id, term_freq, total_doc_tokens, tf_idf in term_docs]
@@ -393,7 +489,7 @@ class BooleanRetrievalRunner:
         results_cnt = len(op_no_score)
         return op_no_score, results_cnt
 
-    def run_indexer(self, corpus_path):
+    def run_indexer(self, corpus_path, workers=None, chunk_size=1000):
         """ This function reads & indexes the corpus. After creating the inverted index,
             it sorts the index by the terms, add skip pointers, and calculates the tf-idf scores.
             Already implemented, but you can modify the orchestration, as you seem fit."""
@@ -401,12 +497,25 @@ class BooleanRetrievalRunner:
         #     for line in tqdm(fp.readlines()):
         #         doc_id, document = self.preprocessor.get_doc_id(line)
         #         tokenized_document = self.preprocessor.tokenizer(document)
-        preprocessed_data = self.preprocessor.preprocess_2(corpus_path)
+        preprocessed_data = self.preprocessor.preprocess_2(corpus_path, workers=workers, chunk_size=chunk_size)
         inverted_index, total_docs = self.indexer.create_index(preprocessed_data)
         self.indexer.sort_terms()
         self.indexer.add_skip_connections()
         self.indexer.calculate_tf_idf(total_docs)
 
+    def add_documents(self, documents):
+        """ Incrementally indexes (doc_id, text) pairs, e.g. newly crawled Wikipedia summaries."""
+        for doc_id, text in documents:
+            self.indexer.add_document(doc_id, self.preprocessor.tokenizer(text))
+
+    def delete_documents(self, doc_ids):
+        for doc_id in doc_ids:
+            self.indexer.delete_document(doc_id)
+
+    def load_index(self, segment_path):
+        """ Loads a prebuilt index segment (see build_segment.py) instead of indexing the corpus on startup."""
+        self.indexer.load_segment(segment_path)
+
     def sanity_checker(self, command):
         """ DO NOT MODIFY THIS. THIS IS USED BY THE GRADER. """
 
@@ -0,0 +1,29 @@
+import argparse
+import time
+
+from boolean_retrieval_runner import BooleanRetrievalRunner
+from postings import ArrayPostingsList
+
+
+def build_segment(corpus_path, segment_path, workers=None, chunk_size=1000):
+    """ Indexes the corpus produced by CorpusCreator offline and writes it out as a segment
+        that server.py can memory-map on startup."""
+    start_time = time.time()
+    runner = BooleanRetrievalRunner(postings_cls=ArrayPostingsList)
+    runner.run_indexer(corpus_path, workers=workers, chunk_size=chunk_size)
+    index_time = time.time() - start_time
+
+    runner.indexer.save_segment(segment_path)
+    print(f"Indexed {runner.indexer.total_docs} docs, {len(runner.indexer.get_index())} terms in {index_time:.2f}s")
+    print(f"Segment written to {segment_path} in {time.time() - start_time - index_time:.2f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build a DaaT index segment from a corpus file")
+    parser.add_argument('--corpus', default='./corpus/corpus_main.txt', help="Corpus file written by CorpusCreator")
+    parser.add_argument('--output', default='index.seg', help="Path of the segment file to write")
+    parser.add_argument('--workers', type=int, default=None, help="Tokenization processes (defaults to the CPU count)")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="Corpus lines per tokenization task")
+    args = parser.parse_args()
+
+    build_segment(args.corpus, args.output, workers=args.workers, chunk_size=args.chunk_size)
@@ -1,13 +1,93 @@
 from linkedlist import LinkedList
+from segment import write_segment, load_segment
+import collections
 from collections import OrderedDict
 from preprocessor import Preprocessor
 import math
+from bisect import bisect_left
+import threading
 from tqdm import tqdm
 
-class Indexer:
+
+class DocIdBitmap:
+    """ Set of doc ids, one bit per doc id."""
+    def __init__(self):
+        self.bits = bytearray()
+        self.count = 0
+
+    def add(self, doc_id):
+        byte_index, bit = divmod(doc_id, 8)
+        if byte_index >= len(self.bits):
+            self.bits.extend(bytes(byte_index - len(self.bits) + 1))
+        if not self.bits[byte_index] & (1 << bit):
+            self.bits[byte_index] |= 1 << bit
+            self.count += 1
+            return True
+        return False
+
+    def discard(self, doc_id):
+        if doc_id in self:
+            byte_index, bit = divmod(doc_id, 8)
+            self.bits[byte_index] &= ~(1 << bit)
+            self.count -= 1
+
+    def copy(self):
+        bitmap = DocIdBitmap()
+        bitmap.bits, bitmap.count = bytearray(self.bits), self.count
+        return bitmap
+
+    def __contains__(self, doc_id):
+        byte_index, bit = divmod(doc_id, 8)
+        return byte_index < len(self.bits) and bool(self.bits[byte_index] & (1 << bit))
+
+    def __len__(self):
+        return self.count
+
+
+class TombstoneBitmap(DocIdBitmap):
+    """ Deleted documents of one segment. Also keeps the deletion order, so per term counts of deleted postings
+        can be brought up to date by looking at the new deletions only."""
     def __init__(self):
-        """ Add more attributes if needed"""
+        super().__init__()
+        self.log = []
+
+    def add(self, doc_id):
+        if super().add(doc_id):
+            self.log.append(doc_id)
+            return True
+        return False
+
+
+class Indexer:
+    def __init__(self, postings_cls=LinkedList):
+        """ Add more attributes if needed.
+            postings_cls: container used for each postings list, LinkedList or the array backed ArrayPostingsList."""
         self.inverted_index = OrderedDict({})
+        self.postings_cls = postings_cls
+        self.total_docs = 0
+
+        # Incremental updates: the live index is split into segments that never share a live document, the main
+        # index, the delta being merged (while merge_delta runs) & the delta of newly added documents. Deleting or
+        # replacing a document removes it from the delta, or tombstones it in the older segment that holds it.
+        # The delta is folded into the main index by merge_delta (in the background once merge_threshold docs are added).
+        self.delta_documents = {}
+        self.delta_index = {}
+        self.tombstones = TombstoneBitmap()
+        self.merge_threshold = 1000
+        self.use_log = False
+        self.idf_total_docs = 0
+        self._main_doc_ids = None
+        self._merging_documents = {}
+        self._merging_index = {}
+        self._merging_deleted = TombstoneBitmap()
+        self._delta_postings = {}
+        self._merging_postings = {}
+        self._deleted_counts = {}
+        self._rescored_postings = {}
+        self._live_postings = {}
+        self._merge_thread = None
+        self._lock = threading.RLock()
+        self._merge_lock = threading.Lock()
 
     def get_index(self, skip_connections=False):
         """ Function to get the index.
@@ -15,13 +95,19 @@ class Indexer:
         return self.inverted_index
 
     def generate_inverted_index(self, doc_id, tokenized_document):
-        """ This function adds each tokenized document to the index. This in turn uses the function add_to_index
-            Already implemented."""
-        doc_length = len(tokenized_document)
-        unique_tokens = list(set(tokenized_document))
-        for token in unique_tokens:
-            token_freq = Preprocessor.get_token_freq(token, tokenized_document)
-            self.add_to_index(token, doc_id, token_freq, doc_length)
+        """ This function adds each tokenized document to the index. The term frequencies of the document are
+            counted in a single pass & handed to add_document_postings."""
+        self.add_document_postings(doc_id, collections.Counter(tokenized_document), len(tokenized_document))
+
+    def add_document_postings(self, doc_id, term_counts, doc_length):
+        """ Batched postings builder: appends one (doc_id, token_freq, doc_length) posting for every distinct
+            term of a document, given its term counts."""
+        inverted_index = self.inverted_index
+        for term, token_freq in term_counts.items():
+            postings_list = inverted_index.get(term)
+            if postings_list is None:
+                postings_list = inverted_index[term] = self.postings_cls()
+            postings_list.insert_at_end((doc_id, token_freq, doc_length))
 
 
     def add_to_index(self, term, doc_id, token_freq, doc_length):
@@ -30,7 +116,7 @@ class Indexer:
             If a term is present, then add the document to the appropriate position in the posstings list of the term.
             To be implemented."""
         if term not in self.inverted_index:
-            self.inverted_index[term] = LinkedList()
+            self.inverted_index[term] = self.postings_cls()
         self.inverted_index[term].insert_at_end((doc_id, token_freq, doc_length))
 
         
@@ -42,6 +128,7 @@ class Indexer:
             docs.append(doc_id)
 
         total_docs = len(docs)
+        self.total_docs = total_docs
         return self.inverted_index, total_docs
 
     def create_postings_dict(self, preprocessed_data):
@@ -49,14 +136,10 @@ class Indexer:
         docs = []
 
         for doc_id, tokens in tqdm(preprocessed_data, desc="Creating Postings Dictionary", colour='green'):
-            all_tokens = tokens
-            unique_tokens = list(set(tokens))
-
-            for token in unique_tokens:
+            for token, token_freq in collections.Counter(tokens).items():
                 if token not in postings_dict:
-                    token_freq = Preprocessor.get_token_freq(token, all_tokens)
-                    postings_dict[token] = LinkedList()
-                postings_dict[token].insert_at_end((doc_id, token_freq, len(all_tokens)))
+                    postings_dict[token] = self.postings_cls()
+                postings_dict[token].insert_at_end((doc_id, token_freq, len(tokens)))
 
             docs.append(doc_id)
 
@@ -103,25 +186,269 @@ class Indexer:
 
         for term, posting_list in self.inverted_index.items():
             term_docs, list_head = posting_list.traverse_list()
+            updated_index[term] = self._build_postings([posting[:3] for posting in term_docs], total_docs, use_log)
 
-            idf = math.log(total_docs / len(term_docs)) if use_log else (total_docs / len(term_docs))
+        self.inverted_index = updated_index
+        self._main_doc_ids = None
+        self.use_log = use_log
+        self.idf_total_docs = total_docs
 
-            updated_posting = LinkedList()
-            for term_doc in term_docs:
-                doc_id, term_freq, total_doc_tokens = term_doc
-                tf = term_freq / total_doc_tokens
-                tf_idf = tf * idf
-                updated_posting.insert_at_end((doc_id, term_freq, total_doc_tokens, tf_idf))
-
-            if hasattr(posting_list, 'skip_length'):
-                updated_posting.skip_length = posting_list.skip_length
-                updated_posting.n_skips = posting_list.n_skips
-                updated_posting.add_skip_connections()
-                
-            updated_index[term] = updated_posting
+        return self.inverted_index
 
-        self.inverted_index = updated_index
+    def _idf(self, total_docs, doc_freq):
+        return math.log(total_docs / doc_freq) if self.use_log else (total_docs / doc_freq)
+
+    def _build_postings(self, term_docs, total_docs, use_log=False, idf=None):
+        """ Builds a postings list with tf-idf scores, skip pointers & score bounds from sorted
+            (doc_id, term_freq, total_doc_tokens) postings. idf defaults to the idf of the term over total_docs."""
+        if idf is None:
+            idf = math.log(total_docs / len(term_docs)) if use_log else (total_docs / len(term_docs))
 
+        postings_list = self.postings_cls()
+        postings_list.extend_sorted(
+            (doc_id, term_freq, total_doc_tokens, (term_freq / total_doc_tokens) * idf)
+            for doc_id, term_freq, total_doc_tokens in term_docs
+        )
+        postings_list.add_skip_connections()
+
+        # Per term & per block tf-idf upper bounds for top-k retrieval
+        postings_list.compute_score_bounds()
+        return postings_list
+
+    def add_document(self, doc_id, tokenized_document):
+        """ Adds a new document without rebuilding the index. Its postings go to the in-memory delta index &
+            become visible to queries straight away. Adding an id that is already indexed replaces that document."""
+        with self._lock:
+            was_live = self._is_live(doc_id)
+            self._remove_document(doc_id)
+            term_counts = collections.Counter(tokenized_document)
+            self.delta_documents[doc_id] = (term_counts, len(tokenized_document))
+            for term in term_counts:
+                self.delta_index.setdefault(term, set()).add(doc_id)
+                self._delta_postings.pop(term, None)
+            if not was_live:
+                self.total_docs += 1
+            self._live_postings = {}
+            merge_due = len(self.delta_documents) >= self.merge_threshold
+
+        if merge_due:
+            self.merge_in_background()
+
+    def delete_document(self, doc_id):
+        """ Deletes a document. It is filtered out at query time & physically removed on the next merge.
+            Unknown or already deleted ids are ignored."""
+        with self._lock:
+            if self._is_live(doc_id):
+                self._remove_document(doc_id)
+                self.total_docs -= 1
+                self._live_postings = {}
+
+    def _main_doc_id_bitmap(self):
+        """ Doc ids stored in the main index (deleted ones included). Collected from the postings on the first
+            update after the main index was built or loaded."""
+        if self._main_doc_ids is None:
+            doc_ids = DocIdBitmap()
+            for postings_list in self.inverted_index.values():
+                for doc_id in postings_list.doc_ids():
+                    doc_ids.add(doc_id)
+            self._main_doc_ids = doc_ids
+        return self._main_doc_ids
+
+    def _is_live(self, doc_id):
+        if doc_id in self.delta_documents:
+            return True
+        if doc_id in self._merging_documents:
+            return doc_id not in self._merging_deleted
+        return doc_id in self._main_doc_id_bitmap() and doc_id not in self.tombstones
+
+    def _remove_document(self, doc_id):
+        """ Removes the live version of a document from whichever segment holds it."""
+        document = self.delta_documents.pop(doc_id, None)
+        if document is not None:
+            for term in document[0]:
+                doc_ids = self.delta_index[term]
+                doc_ids.discard(doc_id)
+                if not doc_ids:
+                    del self.delta_index[term]
+                self._delta_postings.pop(term, None)
+        elif doc_id in self._merging_documents:
+            self._merging_deleted.add(doc_id)
+        elif doc_id in self._main_doc_id_bitmap():
+            self.tombstones.add(doc_id)
+
+    def has_pending_updates(self):
+        return bool(self.delta_documents or self._merging_documents or len(self.tombstones)) \
+            or self.total_docs != self.idf_total_docs
+
+    def get_live_segments(self, terms):
+        """ The postings of terms in each segment of the live index, as a list of (postings, scales, deleted):
+            postings maps each term to its postings list in the segment (None if the term does not occur in it),
+            scales maps each term to the factor turning the tf-idf stored in the segment into the tf-idf under the
+            current live document counts, and deleted holds the segment's deleted doc ids (None if there are none),
+            which queries have to skip. No postings list is rebuilt: the idf is applied through scales.
+            Every live document is in exactly one segment, so a query can run on each segment on its own."""
+        with self._lock:
+            if not self.has_pending_updates():
+                return [({term: self.inverted_index.get(term) for term in terms}, dict.fromkeys(terms, 1.0), None)]
+
+            main = {term: self.inverted_index.get(term) for term in terms}
+            merging = {term: self._documents_postings(term, self._merging_documents, self._merging_index,
+                                                      self._merging_postings) for term in terms}
+            delta = {term: self._documents_postings(term, self.delta_documents, self.delta_index,
+                                                    self._delta_postings) for term in terms}
+
+            main_scales, merging_scales, delta_scales = {}, {}, {}
+            for term in terms:
+                doc_freq = sum(postings_list.length for postings_list in (main[term], merging[term], delta[term])
+                               if postings_list is not None)
+                if main[term] is not None:
+                    doc_freq -= self._deleted_count('main', term, main[term], self.tombstones)
+                if merging[term] is not None:
+                    doc_freq -= self._deleted_count('merging', term, merging[term], self._merging_deleted)
+                idf = self._idf(max(self.total_docs, 1), doc_freq) if doc_freq else 0.0
+
+                # Delta postings are stored with an idf of 1
+                merging_scales[term] = delta_scales[term] = idf
+                if main[term] is not None:
+                    stored_idf = self._idf(max(self.idf_total_docs, 1), main[term].length)
+                    if stored_idf == 0:
+                        # log idf of a term in every document: the stored scores are all 0 & cannot be rescaled
+                        main[term] = self._rescored_main_postings(term)
+                        stored_idf = 1.0
+                    main_scales[term] = idf / stored_idf
+
+            segments = [(main, main_scales, self.tombstones if len(self.tombstones) else None),
+                        (merging, merging_scales, self._merging_deleted if len(self._merging_deleted) else None),
+                        (delta, delta_scales, None)]
+            return [segment for segment in segments if any(postings_list is not None for postings_list in segment[0].values())]
+
+    def _documents_postings(self, term, documents, term_index, cache):
+        """ Postings list of term over the documents of the delta (or the delta being merged), tf-idf with an idf
+            of 1. Built on first use & cached until a document containing the term changes."""
+        doc_ids = term_index.get(term)
+        if not doc_ids:
+            return None
+        if term not in cache:
+            cache[term] = self._build_postings(
+                [(doc_id, documents[doc_id][0][term], documents[doc_id][1]) for doc_id in sorted(doc_ids)],
+                1, idf=1.0)
+        return cache[term]
+
+    def _deleted_count(self, segment_name, term, postings_list, deleted):
+        """ Number of deleted documents in a term's postings list, updated incrementally from the deletion log."""
+        seen, count = self._deleted_counts.get((segment_name, term), (0, 0))
+        if seen < len(deleted.log):
+            doc_ids = postings_list.doc_ids()
+            for doc_id in deleted.log[seen:]:
+                position = bisect_left(doc_ids, doc_id)
+                if position < len(doc_ids) and doc_ids[position] == doc_id:
+                    count += 1
+            self._deleted_counts[(segment_name, term)] = (len(deleted.log), count)
+        return count
+
+    def _rescored_main_postings(self, term):
+        if term not in self._rescored_postings:
+            traversal = self.inverted_index[term].traverse_list()
+            self._rescored_postings[term] = self._build_postings([posting[:3] for posting in traversal[0]], 1, idf=1.0)
+        return self._rescored_postings[term]
+
+    def get_term_postings(self, term):
+        """ Returns the postings list of a term as queries should see it, or None if the term is not indexed.
+            With pending updates the live segments are merged into one list, without deleted documents & with tf-idf
+            from the live document counts. This copies the postings; the query paths that only walk doc ids &
+            scores use get_live_segments instead. Results are cached until the next update."""
+        if not self.has_pending_updates():
+            return self.inverted_index[term] if term in self.inverted_index else None
+
+        with self._lock:
+            if term not in self._live_postings:
+                term_docs = []
+                for postings, scales, deleted in self.get_live_segments([term]):
+                    if postings[term] is not None:
+                        term_docs.extend(posting[:3] for posting in postings[term].traverse_list()[0]
+                                         if deleted is None or posting[0] not in deleted)
+                term_docs.sort(key=lambda posting: posting[0])
+                self._live_postings[term] = self._build_postings(term_docs, max(self.total_docs, 1), self.use_log) \
+                    if term_docs else None
+            return self._live_postings[term]
+
+    def merge_delta(self):
+        """ Folds the delta index into the main index & purges deleted documents, then swaps the merged index in.
+            Documents added or deleted while the merge runs are kept for the next merge."""
+        with self._merge_lock:
+            self._merge_delta()
+
+    def _merge_delta(self):
+        # Called with _merge_lock held
+        with self._lock:
+            documents, term_index = self.delta_documents, self.delta_index
+            self.delta_documents, self.delta_index, self._delta_postings = {}, {}, {}
+            self._merging_documents, self._merging_index = documents, term_index
+            self._merging_postings, self._merging_deleted = {}, TombstoneBitmap()
+            tombstones, purged = self.tombstones, len(self.tombstones.log)
+            main_index, main_doc_ids = self.inverted_index, self._main_doc_id_bitmap()
+            # Every live document ends up in the merged index
+            merged_total_docs = self.total_docs
+
+        deleted = set(tombstones.log[:purged])
+        merged_index = OrderedDict({})
+        for term in sorted(set(main_index.keys()) | set(term_index.keys())):
+            term_docs = []
+            if term in main_index:
+                traversal = main_index[term].traverse_list()
+                term_docs.extend(posting[:3] for posting in (traversal[0] if traversal else [])
+                                 if posting[0] not in deleted)
+            term_docs.extend((doc_id, documents[doc_id][0][term], documents[doc_id][1])
+                             for doc_id in term_index.get(term, ()))
+            if term_docs:
+                term_docs.sort(key=lambda posting: posting[0])
+                merged_index[term] = self._build_postings(term_docs, max(merged_total_docs, 1), self.use_log)
+
+        merged_doc_ids = main_doc_ids.copy()
+        for doc_id in deleted:
+            merged_doc_ids.discard(doc_id)
+        for doc_id in documents:
+            merged_doc_ids.add(doc_id)
+
+        with self._lock:
+            # Deletions made during the merge now apply to the merged index
+            merged_tombstones = TombstoneBitmap()
+            for doc_id in tombstones.log[purged:] + self._merging_deleted.log:
+                merged_tombstones.add(doc_id)
+            self.inverted_index = merged_index
+            self.idf_total_docs = merged_total_docs
+            self._main_doc_ids = merged_doc_ids
+            self.tombstones = merged_tombstones
+            self._merging_documents, self._merging_index = {}, {}
+            self._merging_postings, self._merging_deleted = {}, TombstoneBitmap()
+            self._deleted_counts, self._rescored_postings, self._live_postings = {}, {}, {}
+
+    def merge_in_background(self):
+        if self._merge_thread is not None and self._merge_thread.is_alive():
+            return self._merge_thread
+        self._merge_thread = threading.Thread(target=self.merge_delta, daemon=True)
+        self._merge_thread.start()
+        return self._merge_thread
+
+    def save_segment(self, segment_path):
+        """ Writes the index (postings, skip lengths & tf-idf scores) to a binary segment file.
+            Pending updates are merged into the main index first, so the segment holds exactly the live documents;
+            updates made while the file is written are not part of it."""
+        with self._merge_lock:
+            while True:
+                with self._lock:
+                    if not self.has_pending_updates():
+                        inverted_index, total_docs = self.inverted_index, self.idf_total_docs
+                        break
+                self._merge_delta()
+        write_segment(segment_path, inverted_index, total_docs)
+
+    def load_segment(self, segment_path):
+        """ Memory-maps a segment written by save_segment and serves the index from it (read only)."""
+        self.inverted_index = load_segment(segment_path)
+        self._main_doc_ids = None
+        self.total_docs = self.inverted_index.total_docs
+        self.idf_total_docs = self.total_docs
         return self.inverted_index
     
 
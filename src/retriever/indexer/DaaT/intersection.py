@@ -0,0 +1,115 @@
+from bisect import bisect_left
+
+# Length ratios (longer / shorter list) at which a cheaper strategy than a plain linear merge pays off.
+SKIP_RATIO = 4
+GALLOP_RATIO = 32
+
+
+def choose_strategy(short_length, long_length, skip_length=None):
+    """ Picks the intersection strategy for a pair of postings lists from their length ratio.
+        Similar lengths: linear merge. Moderately skewed: skip pointers (if the longer list has them).
+        Heavily skewed (e.g. 20 vs 20,000 docs): galloping search over the longer list."""
+    ratio = long_length / max(short_length, 1)
+    if ratio >= GALLOP_RATIO:
+        return 'gallop'
+    if ratio >= SKIP_RATIO and skip_length and skip_length > 1:
+        return 'skip'
+    return 'linear'
+
+
+def linear_intersect(candidates, doc_ids):
+    """ Two pointer merge. Returns the positions (in candidates) of the matching doc ids & the comparisons made."""
+    matches = []
+    num_comparisons = 0
+    i, j = 0, 0
+    while i < len(candidates) and j < len(doc_ids):
+        num_comparisons += 1
+        if candidates[i] == doc_ids[j]:
+            matches.append(i)
+            i += 1
+            j += 1
+        elif candidates[i] < doc_ids[j]:
+            i += 1
+        else:
+            j += 1
+    return matches, num_comparisons
+
+
+def skip_intersect(candidates, doc_ids, skip_length):
+    """ Merge that follows the evenly spaced skip pointers (every skip_length-th posting) of the longer list."""
+    matches = []
+    num_comparisons = 0
+    i, j = 0, 0
+    while i < len(candidates) and j < len(doc_ids):
+        num_comparisons += 1
+        if candidates[i] == doc_ids[j]:
+            matches.append(i)
+            i += 1
+            j += 1
+        elif candidates[i] < doc_ids[j]:
+            i += 1
+        else:
+            # Follow skips while they do not overshoot the candidate
+            if j % skip_length == 0:
+                while j + skip_length < len(doc_ids) and doc_ids[j + skip_length] <= candidates[i]:
+                    num_comparisons += 1
+                    j += skip_length
+                if doc_ids[j] >= candidates[i]:
+                    continue
+            j += 1
+    return matches, num_comparisons
+
+
+def gallop_intersect(candidates, doc_ids):
+    """ Exponential (doubling) search for each candidate in the longer list, followed by a binary search
+        inside the bracketed range. Cost grows with the shorter list & log of the gaps, not the longer list."""
+    matches = []
+    num_comparisons = 0
+    low = 0
+    length = len(doc_ids)
+    for i, doc_id in enumerate(candidates):
+        if low >= length:
+            break
+        step = 1
+        high = low
+        while high < length and doc_ids[high] < doc_id:
+            num_comparisons += 1
+            low = high + 1
+            high = low + step
+            step *= 2
+        high = min(high + 1, length)
+        num_comparisons += max(1, (high - low).bit_length())
+        low = bisect_left(doc_ids, doc_id, low, high)
+        if low < length and doc_ids[low] == doc_id:
+            matches.append(i)
+            low += 1
+    return matches, num_comparisons
+
+
+def intersect_postings(postings_columns):
+    """ Intersects the postings of all query terms in one pass, shortest list first, so the candidate set only
+        shrinks. Each step picks its own strategy based on the length ratio of the candidates vs the next list.
+        postings_columns: list of (doc_ids, skip_length) tuples, already sorted by length.
+        Returns the positions of the matches in the shortest list & the total comparisons."""
+    if not postings_columns:
+        return [], 0
+
+    shortest_doc_ids = postings_columns[0][0]
+    positions = list(range(len(shortest_doc_ids)))
+    num_comparisons = 0
+
+    for doc_ids, skip_length in postings_columns[1:]:
+        if not positions:
+            break
+        candidates = [shortest_doc_ids[position] for position in positions]
+        strategy = choose_strategy(len(candidates), len(doc_ids), skip_length)
+        if strategy == 'gallop':
+            matches, comparisons = gallop_intersect(candidates, doc_ids)
+        elif strategy == 'skip':
+            matches, comparisons = skip_intersect(candidates, doc_ids, skip_length)
+        else:
+            matches, comparisons = linear_intersect(candidates, doc_ids)
+        positions = [positions[match] for match in matches]
+        num_comparisons += comparisons
+
+    return positions, num_comparisons
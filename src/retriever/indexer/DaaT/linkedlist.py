@@ -27,6 +27,8 @@ class LinkedList:
         self.end_node = None
         self.length, self.n_skips, self.idf = 0, 0, 0.0
         self.skip_length = None
+        self.max_tf_idf, self.block_size, self.block_max = 0.0, 1, []
+        self._columns = None
 
     def traverse_list(self):
         traversal = []
@@ -113,20 +115,26 @@ class LinkedList:
         """ Write logic to add new elements to the linked list.
             Insert the element at an appropriate position, such that elements to the left are lower than the inserted
             element, and elements to the right are greater than the inserted element.
-            To be implemented. """
+            Values arriving in order (>= the tail) are appended in O(1) through end_node, the sorted walk from
+            start_node is only used as a fallback for out of order values."""
         new_node = Node(value)
+        self._columns = None
         if criteria == 'doc_id':
             tuple_index = 0 # doc_id
         else:
             tuple_index = 3 # tf-idf
-            # print("NEW NODE: ", new_node.value[tuple_index]) 
 
-               
+        if self.end_node and self.end_node.value[tuple_index] <= value[tuple_index]:
+            self.end_node.next = new_node
+            self.end_node = new_node
+            self.length += 1
+            return
+
         if not self.start_node or self.start_node.value[tuple_index] > value[tuple_index]:
-            # print("SELF START NODE: ", self.start_node.value[tuple_index])
             new_node.next = self.start_node
             self.start_node = new_node
-            self.end_node = new_node
+            if self.end_node is None:
+                self.end_node = new_node
             self.length += 1
             return
         else:
@@ -137,6 +145,46 @@ class LinkedList:
 
             new_node.next = curr_node.next
             curr_node.next = new_node
+            if new_node.next is None:
+                self.end_node = new_node
             self.length += 1
             return
 
+    def doc_ids(self):
+        """ Returns the doc ids of the list in order."""
+        if self._columns is not None:
+            return self._columns[0]
+        doc_ids = []
+        current_node = self.start_node
+        while current_node is not None:
+            doc_ids.append(current_node.value[0])
+            current_node = current_node.next
+        return doc_ids
+
+    def score_columns(self):
+        """ Returns the doc ids & tf-idf scores of the list as two parallel lists (used by ranked retrieval and the
+            intersections). Built on the first call, which compute_score_bounds makes once tf-idf is computed, and
+            kept until the next insert."""
+        if self._columns is None:
+            doc_ids, tf_idfs = [], []
+            current_node = self.start_node
+            while current_node is not None:
+                doc_ids.append(current_node.value[0])
+                tf_idfs.append(current_node.value[3])
+                current_node = current_node.next
+            self._columns = doc_ids, tf_idfs
+        return self._columns
+
+    def compute_score_bounds(self):
+        """ Pre-computes the upper bounds used by block-max WAND: the maximum tf-idf of the whole list and of
+            every block of postings. Blocks line up with the skip pointers (skip_length postings each)."""
+        doc_ids, tf_idfs = self.score_columns()
+        self.block_size = max(1, self.skip_length or int(round(math.sqrt(self.length))))
+        self.block_max = [max(tf_idfs[i:i + self.block_size]) for i in range(0, len(tf_idfs), self.block_size)]
+        self.max_tf_idf = max(self.block_max) if self.block_max else 0.0
+
+    def extend_sorted(self, values, criteria='doc_id'):
+        """ Bulk builder for values that are already sorted (e.g. a postings list being rebuilt with tf-idf scores).
+            Each value goes through the O(1) append path of insert_at_end."""
+        for value in values:
+            self.insert_at_end(value, criteria)
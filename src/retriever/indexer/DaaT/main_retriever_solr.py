@@ -10,19 +10,16 @@ import collections
 import nltk
 from nltk.stem import PorterStemmer
 import re
-from nltk.corpus import stopwords
 from nltk.tokenize import WhitespaceTokenizer
-nltk.download('stopwords')
 from tqdm import tqdm
+from stopwords_en import STOP_WORDS
 import threading
 
-nltk.download()
-nltk.download('stopwords')
 
 # Query Preprocessing
 class Preprocessor:
     def __init__(self):
-        self.stop_words = set(stopwords.words('english'))
+        self.stop_words = STOP_WORDS
         self.ps = PorterStemmer()
 
     def get_doc_id(self, doc):
@@ -0,0 +1,172 @@
+import math
+from array import array
+from bisect import bisect_right
+
+
+class PostingCursor:
+    """ Lightweight stand-in for a linked list 'Node' over an array backed postings list.
+        Exposes value, next & skip so the pointer based merge code keeps working unchanged."""
+    __slots__ = ('postings', 'position')
+
+    def __init__(self, postings, position):
+        self.postings = postings
+        self.position = position
+
+    @property
+    def value(self):
+        return self.postings.get_posting(self.position)
+
+    @property
+    def next(self):
+        position = self.position + 1
+        if position < self.postings.length:
+            return PostingCursor(self.postings, position)
+        return None
+
+    @property
+    def skip(self):
+        skip_position = self.postings.skip_target(self.position)
+        if skip_position is None:
+            return None
+        return PostingCursor(self.postings, skip_position)
+
+
+class ArrayPostingsList:
+    """ Postings list stored as contiguous parallel arrays instead of one 'Node' object per posting.
+        Doc ids, term frequencies & document lengths are stored in array('I') and tf-idf scores in an array('f').
+        Doc ids are absolute (fixed width gaps would not be any smaller), so cursors can binary search the column
+        directly, including when it is a view over a memory-mapped segment. Mirrors the LinkedList interface so that the Indexer and the
+        BooleanRetrievalRunner can use either representation."""
+    def __init__(self):
+        self.doc_id_column = array('I')
+        self.term_freqs = array('I')
+        self.doc_lengths = array('I')
+        self.tf_idfs = array('f')
+        self.has_tf_idf = False
+        self.last_doc_id = None
+        self.length, self.n_skips, self.idf = 0, 0, 0.0
+        self.skip_length = None
+        self.max_tf_idf, self.block_size, self.block_max = 0.0, 1, array('f')
+
+    @classmethod
+    def from_buffers(cls, doc_ids, term_freqs, doc_lengths, tf_idfs, skip_length=0, has_tf_idf=True,
+                     block_size=1, block_max=None, max_tf_idf=0.0):
+        """ Wraps existing columns (e.g. memoryviews over a memory-mapped segment) without copying them.
+            Lists created this way are read only."""
+        postings_list = cls()
+        postings_list.doc_id_column = doc_ids
+        postings_list.term_freqs = term_freqs
+        postings_list.doc_lengths = doc_lengths
+        postings_list.tf_idfs = tf_idfs
+        postings_list.has_tf_idf = has_tf_idf
+        postings_list.length = len(doc_ids)
+        postings_list.last_doc_id = doc_ids[-1] if postings_list.length else None
+        postings_list.skip_length = skip_length
+        if postings_list.length > 2 and skip_length:
+            postings_list.n_skips = (postings_list.length - 1) // skip_length
+        if block_max is not None:
+            postings_list.block_size = block_size
+            postings_list.block_max = block_max
+            postings_list.max_tf_idf = max_tf_idf
+        return postings_list
+
+    @property
+    def start_node(self):
+        return PostingCursor(self, 0) if self.length else None
+
+    @property
+    def end_node(self):
+        return PostingCursor(self, self.length - 1) if self.length else None
+
+    def doc_ids(self):
+        return self.doc_id_column
+
+    def get_posting(self, position):
+        doc_id = self.doc_id_column[position]
+        if self.has_tf_idf:
+            return doc_id, self.term_freqs[position], self.doc_lengths[position], self.tf_idfs[position]
+        return doc_id, self.term_freqs[position], self.doc_lengths[position]
+
+    def skip_target(self, position):
+        """ Skip pointers are implicit: every skip_length-th posting points skip_length postings ahead,
+            which is the same layout LinkedList.add_skip_connections builds."""
+        if not self.n_skips or position % self.skip_length:
+            return None
+        target = position + self.skip_length
+        return target if target < self.length else None
+
+    def traverse_list(self):
+        if not self.length:
+            return
+        traversal = [self.get_posting(position) for position in range(self.length)]
+        return traversal, self.start_node
+
+    def traverse_skips(self):
+        if not self.length:
+            return
+        step = self.skip_length if self.n_skips else self.length
+        return [self.get_posting(position) for position in range(0, self.length, step)]
+
+    def add_skip_connections(self):
+        self.skip_length = int(round(math.sqrt(self.length)))
+        if self.length <= 2:
+            self.n_skips = 0
+            return
+        self.n_skips = (self.length - 1) // self.skip_length
+
+    def _append(self, value):
+        doc_id = value[0]
+        self.doc_id_column.append(doc_id)
+        self.term_freqs.append(value[1])
+        self.doc_lengths.append(value[2])
+        if len(value) > 3:
+            if not self.has_tf_idf:
+                self.tf_idfs.extend([0.0] * self.length)
+                self.has_tf_idf = True
+            self.tf_idfs.append(value[3])
+        elif self.has_tf_idf:
+            self.tf_idfs.append(0.0)
+        self.last_doc_id = doc_id
+        self.length += 1
+
+    def insert_at_end(self, value, criteria='doc_id'):
+        """ Adds a posting keeping the list ordered by doc id. Doc ids arrive in increasing order while indexing,
+            so this is a plain append; out of order doc ids fall back to re-encoding the list."""
+        if criteria != 'doc_id':
+            raise ValueError("ArrayPostingsList is always ordered by doc_id")
+
+        if self.last_doc_id is None or value[0] >= self.last_doc_id:
+            self._append(value)
+            return
+
+        postings = self.traverse_list()[0]
+        postings.insert(bisect_right(self.doc_id_column, value[0]), value)
+        self._reset()
+        for posting in postings:
+            self._append(posting)
+
+    def score_columns(self):
+        """ Returns the doc ids & tf-idf scores of the list as two parallel arrays (used by ranked retrieval)."""
+        return self.doc_ids(), self.tf_idfs
+
+    def compute_score_bounds(self):
+        """ Pre-computes the upper bounds used by block-max WAND: the maximum tf-idf of the whole list and of
+            every block of postings. Blocks line up with the implicit skip pointers (skip_length postings each)."""
+        self.block_size = max(1, self.skip_length or int(round(math.sqrt(self.length))))
+        self.block_max = array('f', (max(self.tf_idfs[i:i + self.block_size])
+                                     for i in range(0, self.length, self.block_size)))
+        self.max_tf_idf = max(self.block_max) if self.block_max else 0.0
+
+    def extend_sorted(self, values, criteria='doc_id'):
+        """ Bulk builder for values already sorted by doc id."""
+        for value in values:
+            self.insert_at_end(value, criteria)
+
+    def _reset(self):
+        self.doc_id_column = array('I')
+        self.term_freqs = array('I')
+        self.doc_lengths = array('I')
+        self.tf_idfs = array('f')
+        self.has_tf_idf = False
+        self.last_doc_id = None
+        self.length = 0
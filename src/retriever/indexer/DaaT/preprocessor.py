@@ -4,21 +4,53 @@ Institute: University at Buffalo
 '''
 
 import collections
-import nltk
-from nltk.stem import PorterStemmer
+import functools
 import re
-from nltk.corpus import stopwords
-from nltk.tokenize import WhitespaceTokenizer
-nltk.download('stopwords')
 from tqdm import tqdm
-import threading
+from stopwords_en import STOP_WORDS
+import os
+from collections import deque
+from itertools import islice
+
+from concurrent.futures import ProcessPoolExecutor
+
+# Anything that is not a word character or whitespace is replaced by a space
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+STEM_CACHE_SIZE = 100000
+
+
+# Preprocessor owned by each tokenization worker process (see iter_preprocessed)
+_worker_preprocessor = None
+
+
+def _init_tokenizer_worker():
+    global _worker_preprocessor
+    _worker_preprocessor = Preprocessor()
+
+
+def _tokenize_chunk(lines):
+    """ Runs inside a worker process: splits & tokenizes one chunk of corpus lines."""
+    doc_ids, texts = zip(*(_worker_preprocessor.get_doc_id(line) for line in lines)) if lines else ((), ())
+    return list(zip(doc_ids, _worker_preprocessor.tokenize_batch(texts)))
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 class Preprocessor:
-    def __init__(self):
-        self.stop_words = set(stopwords.words('english'))
-        self.ps = PorterStemmer()
+    def __init__(self, stem_cache_size=STEM_CACHE_SIZE):
+        self.stop_words = STOP_WORDS
+        self._ps = None
+        # The vocabulary is tiny compared to the number of tokens, so memoize stems by surface form
+        self.stem = functools.lru_cache(maxsize=stem_cache_size)(self._stem)
+
+    @property
+    def ps(self):
+        """ NLTK is only imported when the first word is stemmed, which keeps it out of service start-up."""
+        if self._ps is None:
+            from nltk.stem import PorterStemmer
+            self._ps = PorterStemmer()
+        return self._ps
+
+    def _stem(self, word):
+        return self.ps.stem(word)
 
     def get_doc_id(self, doc):
         """ Splits each line of the document, into doc_id & text.
@@ -34,29 +66,14 @@ class Preprocessor:
     def tokenizer(self, text):
         """ Implement logic to pre-process & tokenize document text.
             Write the code in such a way that it can be re-used for processing the user's query.
-            To be implemented."""
-        text = text.lower()
-        text = re.sub(r'[^\w\s]', ' ', text)
-
-        # White Space tokenization
-        text = text.strip()
-        tokens = text.split()
-
-        invalid_token_status = False
-
-        # Count white space between words
-        if any(word == '' or word == ' ' for word in tokens):
-            invalid_token_status = True
-            raise ValueError("Invalid token found (space or a blank token)")
-        
-        # Do not include stop words
-        tokens = [word for word in tokens if word not in self.stop_words]
-
-        # Performing Porters stemming
-        stemmer = PorterStemmer()
-        tokens = [stemmer.stem(word) for word in tokens]
-
-        return tokens
+            Lowercase, strip punctuation, whitespace split, drop stop words & Porter stem (through the stem cache)."""
+        stop_words = self.stop_words
+        stem = self.stem
+        return [stem(word) for word in PUNCTUATION_PATTERN.sub(' ', text.lower()).split() if word not in stop_words]
+
+    def tokenize_batch(self, texts):
+        """ Tokenizes a list of texts in one call, sharing the compiled pattern & stem cache."""
+        return [self.tokenizer(text) for text in texts]
     
     def read_file_content(self, file_path):
         try:
@@ -81,39 +98,44 @@ class Preprocessor:
         queries = []
         original_queries = []
         if content:
-            split_content = content.split("\n")
-            
-            for index, line in enumerate(split_content):
-                if line.strip():
-                    queries.append(self.tokenizer(line))
-                    original_queries.append(line)
+            original_queries = [line for line in content.split("\n") if line.strip()]
+            queries = self.tokenize_batch(original_queries)
                 
         return queries, original_queries
 
-    def preprocess_2(self, file_path):
+    def iter_preprocessed(self, file_path, workers=None, chunk_size=1000):
+        """ Streams (doc_id, tokens) for every line of the corpus, in corpus (doc id) order.
+            Lines are read once & tokenized in chunks of chunk_size by a pool of worker processes, with at most
+            2 chunks per worker in flight so memory stays bounded regardless of the corpus size."""
+        workers = workers or os.cpu_count() or 1
+
+        with open(file_path, 'r') as fp:
+            chunks = iter(lambda: list(islice(fp, chunk_size)), [])
+
+            if workers == 1:
+                for chunk in chunks:
+                    for line in chunk:
+                        if line.strip():
+                            doc_id, text = self.get_doc_id(line)
+                            yield doc_id, self.tokenizer(text)
+                return
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_tokenizer_worker) as executor:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(executor.submit(_tokenize_chunk, [line for line in chunk if line.strip()]))
+                    if len(pending) >= 2 * workers:
+                        yield from pending.popleft().result()
+                while pending:
+                    yield from pending.popleft().result()
+
+    def preprocess_2(self, file_path, workers=None, chunk_size=1000):
         preprocessed_data = []
 
         try:
-            with open(file_path, 'r') as fp:
-                total_lines = sum(1 for _ in fp)
-
-            def process_line(line):
-                doc_id, text = self.get_doc_id(line)
-                tokens = self.tokenizer(text)
-                return doc_id, tokens
-            
-            with open(file_path, 'r') as fp:
-                with ThreadPoolExecutor(max_workers=4) as executor:
-                    futures = [executor.submit(process_line, line) for line in fp]
-                    for future in tqdm(as_completed(futures), total=total_lines, desc="Preprocessing", colour='green'):
-                        preprocessed_data.append(future.result())
-
-            # Sequential processing code
-            # with open(file_path, 'r') as fp:
-            #     for line in tqdm(fp, total=total_lines, desc="Preprocessing", colour='green'):
-            #         doc_id, text = self.get_doc_id(line)
-            #         tokens = self.tokenizer(text)
-            #         preprocessed_data.append((doc_id, tokens))
+            for doc_id, tokens in tqdm(self.iter_preprocessed(file_path, workers=workers, chunk_size=chunk_size),
+                                       desc="Preprocessing", colour='green'):
+                preprocessed_data.append((doc_id, tokens))
         except FileNotFoundError:
             print(f"File not found: {file_path}")
         except Exception as e:
@@ -0,0 +1,127 @@
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+
+from postings import ArrayPostingsList
+
+SEGMENT_MAGIC = b'DAATSEG\x00'
+SEGMENT_VERSION = 3
+
+# magic, version, number of terms, total docs, byte order flag (1 = little endian), offset of the term dictionary
+HEADER = struct.Struct('<8sIIIIQ')
+# postings offset, postings length, skip length, has tf-idf, score block size, number of blocks, max tf-idf of the term
+TERM_ENTRY = struct.Struct('<QIIIIIf')
+TERM_LENGTH = struct.Struct('<H')
+
+
+class SegmentFormatError(Exception):
+    pass
+
+
+def _postings_columns(postings_list):
+    """ Returns (doc ids, term freqs, doc lengths, tf-idfs, block max tf-idfs) arrays for either postings
+        representation, along with whether the postings carry tf-idf scores."""
+    if isinstance(postings_list, ArrayPostingsList):
+        tf_idfs = postings_list.tf_idfs if postings_list.has_tf_idf else bytes(4 * postings_list.length)
+        columns = array('I', postings_list.doc_id_column), array('I', postings_list.term_freqs), \
+            array('I', postings_list.doc_lengths), array('f', tf_idfs), array('f', postings_list.block_max)
+        return columns, postings_list.has_tf_idf
+
+    columns = array('I'), array('I'), array('I'), array('f'), array('f', postings_list.block_max)
+    traversal = postings_list.traverse_list()
+    postings = traversal[0] if traversal else []
+    for posting in postings:
+        columns[0].append(posting[0])
+        columns[1].append(posting[1])
+        columns[2].append(posting[2])
+        columns[3].append(posting[3] if len(posting) > 3 else 0.0)
+    return columns, any(len(posting) > 3 for posting in postings[:1])
+
+
+def write_segment(path, inverted_index, total_docs):
+    """ Serializes the inverted index into a single binary segment file.
+        Layout: header | postings blocks (doc ids, tfs, doc lengths, tf-idfs, block max tf-idfs; 4 byte aligned) |
+        term dictionary. Skip tables are stored as the skip length of each postings list since skips are evenly spaced."""
+    entries = []
+    with open(path, 'wb') as fp:
+        fp.write(b'\x00' * HEADER.size)
+        for term, postings_list in inverted_index.items():
+            offset = fp.tell()
+            columns, has_tf_idf = _postings_columns(postings_list)
+            for column in columns:
+                column.tofile(fp)
+            skip_length = postings_list.skip_length or 0
+            entries.append((term, TERM_ENTRY.pack(offset, len(columns[0]), skip_length, int(has_tf_idf),
+                                                  postings_list.block_size, len(columns[4]), postings_list.max_tf_idf)))
+
+        dict_offset = fp.tell()
+        for term, entry in entries:
+            encoded_term = term.encode('utf-8')
+            fp.write(TERM_LENGTH.pack(len(encoded_term)))
+            fp.write(encoded_term)
+            fp.write(entry)
+
+        fp.seek(0)
+        fp.write(HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, len(entries), total_docs,
+                             int(sys.byteorder == 'little'), dict_offset))
+
+
+class SegmentIndex(Mapping):
+    """ Read only inverted index backed by a memory-mapped segment file.
+        Postings lists are zero-copy ArrayPostingsList views over the mapping, so several server processes
+        loading the same segment share one page-cache copy of it."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fp:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+
+        magic, version, n_terms, total_docs, little_endian, dict_offset = HEADER.unpack_from(self._buffer, 0)
+        if magic != SEGMENT_MAGIC:
+            raise SegmentFormatError(f"{path} is not a DaaT segment file")
+        if version != SEGMENT_VERSION:
+            raise SegmentFormatError(f"Unsupported segment version {version}, expected {SEGMENT_VERSION}. Rebuild the segment.")
+        if bool(little_endian) != (sys.byteorder == 'little'):
+            raise SegmentFormatError("Segment was written on a machine with a different byte order")
+
+        self.version = version
+        self.total_docs = total_docs
+        self._terms = {}
+        self._postings = {}
+
+        position = dict_offset
+        for _ in range(n_terms):
+            (term_length,) = TERM_LENGTH.unpack_from(self._buffer, position)
+            position += TERM_LENGTH.size
+            term = bytes(self._buffer[position:position + term_length]).decode('utf-8')
+            position += term_length
+            self._terms[term] = TERM_ENTRY.unpack_from(self._buffer, position)
+            position += TERM_ENTRY.size
+
+    def __getitem__(self, term):
+        if term not in self._postings:
+            offset, length, skip_length, has_tf_idf, block_size, n_blocks, max_tf_idf = self._terms[term]
+            column_size = 4 * length
+            columns = [self._buffer[offset + i * column_size: offset + (i + 1) * column_size] for i in range(4)]
+            blocks_offset = offset + 4 * column_size
+            block_max = self._buffer[blocks_offset: blocks_offset + 4 * n_blocks].cast('f')
+            self._postings[term] = ArrayPostingsList.from_buffers(
+                columns[0].cast('I'), columns[1].cast('I'), columns[2].cast('I'), columns[3].cast('f'),
+                skip_length=skip_length, has_tf_idf=bool(has_tf_idf),
+                block_size=block_size, block_max=block_max, max_tf_idf=max_tf_idf)
+        return self._postings[term]
+
+    def __contains__(self, term):
+        return term in self._terms
+
+    def __iter__(self):
+        return iter(self._terms)
+
+    def __len__(self):
+        return len(self._terms)
+
+
+def load_segment(path):
+    return SegmentIndex(path)
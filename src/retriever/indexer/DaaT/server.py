@@ -2,13 +2,23 @@ import flask
 import time
 from flask import Flask, request
 import hashlib
-import json
+import os
+import sys
 from boolean_retrieval_runner import BooleanRetrievalRunner
+from postings import ArrayPostingsList
+
+# result_archive.py is shared with the Solr retriever server & lives two levels up
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from result_archive import ResultArchiveWriter
 
 
 app = Flask(__name__)
 # output_location = 'output.json'
 username = 'anantha2'
+# Responses are appended to output_flask.jsonl by a background thread instead of rewriting a JSON file per request
+results_archive = ResultArchiveWriter('output_flask.jsonl')
+# Largest k accepted by /execute_ranked_query
+MAX_K = 1000
 
 @app.route("/execute_query", methods=['POST'])
 def execute_query():
@@ -35,9 +45,6 @@ def execute_query():
 
     print('Queries stuff::', normalized_queries, original_queries)
 
-
-    output_location = 'output_flask.json'
-
     """ Running the queries against the pre-loaded index. """
     output_dict = boolean_retrieval_runner.run_queries(normalized_queries, original_queries)
 
@@ -50,16 +57,58 @@ def execute_query():
         "username_hash": username_hash
     }
 
-    """ Dumping the results to a JSON file. """
-    with open(output_location, 'w') as fp:
-        json.dump(response, fp, sort_keys=True, indent=4)
+    results_archive.submit({"queries": request.json["queries"], **response})
 
     return flask.jsonify(response)
 
+@app.route("/execute_ranked_query", methods=['POST'])
+def execute_ranked_query():
+    """ Free-text top-k retrieval against the DaaT index (block-max WAND over tf-idf scores)."""
+    start_time = time.time()
+
+    query = request.json.get("query")
+    k = request.json.get("k", 10)
+    if not isinstance(query, str) or not query.strip():
+        return flask.jsonify({"error": "query must be a non-empty string"}), 400
+    # bool is a subclass of int, so true/false are rejected explicitly
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= MAX_K:
+        return flask.jsonify({"error": f"k must be an integer between 1 and {MAX_K}"}), 400
+
+    normalized_query, original_query = boolean_retrieval_runner.preprocessor.preprocess_query(query=[query])
+    query_terms = sum(normalized_query, [])
+
+    output_dict = boolean_retrieval_runner.run_ranked_query(query_terms, query, k=k)
+
+    response = {
+        "Response": output_dict,
+        "time_taken": str(time.time() - start_time),
+    }
+    return flask.jsonify(response)
+
+@app.route("/add_documents", methods=['POST'])
+def add_documents():
+    """ Adds documents to the live index without a rebuild.
+        Body: {"documents": [{"doc_id": int, "summary": str}, ...]} (WikiRetriever result dicts plus a doc_id)."""
+    documents = request.json["documents"]
+    boolean_retrieval_runner.add_documents(
+        (int(document["doc_id"]), document.get("summary") or document.get("text", "")) for document in documents)
+    return flask.jsonify({"added": len(documents), "total_docs": boolean_retrieval_runner.indexer.total_docs})
+
+@app.route("/delete_documents", methods=['POST'])
+def delete_documents():
+    """ Body: {"doc_ids": [int, ...]}"""
+    doc_ids = [int(doc_id) for doc_id in request.json["doc_ids"]]
+    boolean_retrieval_runner.delete_documents(doc_ids)
+    return flask.jsonify({"deleted": len(doc_ids), "total_docs": boolean_retrieval_runner.indexer.total_docs})
+
 if __name__ == "__main__":
-    boolean_retrieval_runner = BooleanRetrievalRunner()
+    boolean_retrieval_runner = BooleanRetrievalRunner(postings_cls=ArrayPostingsList)
 
     corpus_path = 'input_corpus.txt'
-    boolean_retrieval_runner.run_indexer(corpus_path)
+    segment_path = 'index.seg'
+    if os.path.exists(segment_path):
+        boolean_retrieval_runner.load_index(segment_path)
+    else:
+        boolean_retrieval_runner.run_indexer(corpus_path)
 
     app.run(port=9999)
\ No newline at end of file
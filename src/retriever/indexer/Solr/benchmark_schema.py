@@ -0,0 +1,91 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+from indexer import VM_IP
+
+# The retriever's query builder lives in solr_retriever, so the benchmark sends exactly the queries it sends
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'solr_retriever'))
+from query_builder import build_edismax_query
+
+# Questions in the style the chat UI sends, used when no --queries file is given
+SAMPLE_QUERIES = [
+    "what is the novel coronavirus",
+    "how does cryptocurrency work",
+    "who won the last presidential election",
+    "best places to travel in europe",
+    "what causes climate change",
+    "how do vaccines work",
+    "history of the olympic games",
+    "what is machine learning",
+    "effects of inflation on the economy",
+    "healthy diet for weight loss",
+]
+
+
+def core_stats(solr_url, core):
+    status = requests.get(solr_url + 'admin/cores', params={'action': 'STATUS', 'core': core, 'wt': 'json'}).json()
+    index = status['status'][core]['index']
+    return index['numDocs'], index['sizeInBytes']
+
+
+def core_topics(solr_url, core):
+    facets = requests.get(f'{solr_url}{core}/select', params={
+        'q': '*:*', 'rows': 0, 'facet': 'true', 'facet.field': 'topic', 'facet.limit': -1, 'wt': 'json'}).json()
+    values = facets['facet_counts']['facet_fields']['topic']
+    return values[::2]
+
+
+def query_latencies(solr_url, core, queries, topics, rounds, k=5):
+    """ Server side (QTime) & client side latency in ms of the raw questions, sent per topic with the same edismax
+        parameters as Retriever.retrieve_docs_single_topic."""
+    session = requests.Session()
+    qtimes, latencies = [], []
+    for _ in range(rounds):
+        for query in queries:
+            for topic in topics:
+                start_time = time.perf_counter()
+                params = dict(build_edismax_query(query, [topic], k), wt='json')
+                response = session.get(f'{solr_url}{core}/select', params=params)
+                latencies.append(1000 * (time.perf_counter() - start_time))
+                qtimes.append(response.json()['responseHeader']['QTime'])
+    return qtimes, latencies
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run_benchmark(cores, queries, rounds):
+    """ Compares index size & query latency of cores, e.g. the current core against one built with the schema profile."""
+    solr_url = f'http://{VM_IP}:8983/solr/'
+
+    print(f"{'core':<20}{'docs':>10}{'size MB':>10}{'QTime p50':>12}{'QTime p95':>12}{'client p50':>12}{'client p95':>12}")
+    for core in cores:
+        num_docs, size = core_stats(solr_url, core)
+        topics = core_topics(solr_url, core)
+        # Warm the caches once so both cores are measured in the same state
+        query_latencies(solr_url, core, queries, topics, 1)
+        qtimes, latencies = query_latencies(solr_url, core, queries, topics, rounds)
+        print(f"{core:<20}{num_docs:>10}{size / 1e6:>10.1f}{statistics.median(qtimes):>12.1f}"
+              f"{percentile(qtimes, 0.95):>12.1f}{statistics.median(latencies):>12.1f}{percentile(latencies, 0.95):>12.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Index size & query latency of Solr cores (before/after a schema change)")
+    parser.add_argument('cores', nargs='+', help="Cores to compare, e.g. IRF24P3 IRF24P3_tuned")
+    parser.add_argument('--queries', default=None, help="File with one question per line")
+    parser.add_argument('--rounds', type=int, default=5, help="Times every query is run per topic")
+    args = parser.parse_args()
+
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = SAMPLE_QUERIES
+    run_benchmark(args.cores, queries, args.rounds)
@@ -1,12 +1,21 @@
+import argparse
+import hashlib
 import json
 import os
+import time
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
 import pysolr
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
 
 CORE_NAME = "IRF24P3"
 VM_IP = "34.130.33.83"
 CORPUS_FILE='All_topics_combined_final.json'
+CHECKPOINT_FILE = 'indexer_checkpoint.json'
+# Bytes of the corpus file read at a time by iter_corpus
+READ_SIZE = 1024 * 1024
 
 
 def delete_core(core=CORE_NAME):
@@ -18,86 +27,282 @@ def create_core(core=CORE_NAME):
         'sudo su - solr -c "/opt/solr/bin/solr create -c {core} -n data_driven_schema_configs"'.format(
             core=core)))
 
+
+class _CorpusReader:
+    """ Incremental parser for the combined corpus ({topic: [doc, ...], ...}).
+        Only the current read window is kept in memory; each doc is decoded on its own with JSONDecoder.raw_decode."""
+    def __init__(self, fp, read_size=READ_SIZE):
+        self.fp = fp
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+
+    def _fill(self):
+        data = self.fp.read(self.read_size)
+        if not data:
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def next_char(self):
+        """ Skips whitespace & returns the next significant character without consuming it ('' at end of file)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        char = self.next_char()
+        if char not in chars:
+            raise ValueError(f"Malformed corpus: expected one of {chars!r}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def decode(self):
+        self.next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The value runs past the read window, read more & retry
+                if not self._fill():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+
+def iter_corpus(file_name=CORPUS_FILE):
+    """ Streams (topic, doc) pairs from the combined corpus file in file order, one doc at a time."""
+    with open(file_name) as f:
+        reader = _CorpusReader(f)
+        reader.expect('{')
+        if reader.next_char() == '}':
+            return
+        while True:
+            topic = reader.decode()
+            reader.expect(':')
+            reader.expect('[')
+            if reader.next_char() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    yield topic, reader.decode()
+                    if reader.expect(',]') == ']':
+                        break
+            if reader.expect(',}') == '}':
+                return
+
+
+# Schema profile of the core (applied by Indexer.apply_schema_profile). Only what the retriever uses is indexed
+# or stored: topic is a filter, so it gets docValues; summary is searched & returned but never highlighted,
+# so no term vectors; title is searched through the analyzed title_text copy; url/revision_id are only returned.
+SCHEMA_FIELDS = [
+    {
+        "name": "title",
+        "type": "string",
+        "indexed": True,
+        "stored": True,
+        "docValues": False,
+        "multiValued": False
+    },
+    {
+        "name": "title_text",
+        "type": "text_en",
+        "indexed": True,
+        "stored": False,
+        "multiValued": False
+    },
+    {
+        "name": "revision_id",
+        "type": "string",
+        "indexed": False,
+        "stored": True,
+        "docValues": False,
+        "multiValued": False
+    },
+    {
+        "name": "url",
+        "type": "string",
+        "indexed": False,
+        "stored": True,
+        "docValues": False,
+        "multiValued": False
+    },
+    {
+        "name": "summary",
+        "type": "text_en",
+        "indexed": True,
+        "stored": True,
+        "termVectors": False,
+        "termPositions": False,
+        "termOffsets": False,
+        "multiValued": False
+    },
+    {
+        "name": "topic",
+        "type": "string",
+        "indexed": True,
+        "stored": True,
+        "docValues": True,
+        "multiValued": False
+    },
+]
+# Corpus fields sent to Solr (besides id & topic); anything else in the corpus docs would be rejected by the schema
+CORPUS_FIELDS = ('title', 'summary', 'url', 'revision_id')
+
+
+def document_id(topic, doc):
+    """ Stable Solr id for a corpus doc, so re-sending it (resume, reindex) overwrites instead of duplicating.
+        Based on the revision id, or on the title for docs fetched without one."""
+    key = doc.get('revision_id') or doc.get('title', '')
+    return hashlib.sha1(f'{topic}/{key}'.encode('utf-8')).hexdigest()
+
+
+def to_solr_documents(doc_stream):
+    """ Turns a stream of (topic, doc) into Solr documents with stable ids, skipping docs with no content."""
+    for topic, doc in doc_stream:
+        if not doc.get('summary') or not (doc.get('revision_id') or doc.get('title')):
+            continue
+        solr_doc = {field: doc[field] for field in CORPUS_FIELDS if field in doc}
+        yield {**solr_doc, 'id': document_id(topic, doc), 'topic': topic}
+
+
+def iter_batches(docs, batch_size):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 class Indexer:
-    def __init__(self):
+    def __init__(self, workers=4, core=CORE_NAME):
         self.solr_url = f'http://{VM_IP}:8983/solr/'
-        self.connection = pysolr.Solr(self.solr_url + CORE_NAME, always_commit=True, timeout=5000000)
+        self.core = core
+        # One keep-alive connection per concurrent batch
+        session = requests.Session()
+        session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+        self.connection = pysolr.Solr(self.solr_url + core, session=session, timeout=(3.05, 600))
+        self.workers = workers
 
     def do_initial_setup(self):
-        delete_core()
-        create_core()
+        delete_core(self.core)
+        create_core(self.core)
 
     def create_documents(self, docs):
-        print(self.connection.add(docs))
+        """ Upserts one batch (docs with an existing id are replaced) without committing;
+            visibility & durability are handled by index_documents."""
+        self.connection.add(docs, commit=False, overwrite=True)
+
+    def apply_schema_profile(self):
+        """ Applies SCHEMA_FIELDS & the title -> title_text copy field, and turns off schemaless field guessing
+            (update.autoCreateFields), so documents with unknown fields are rejected instead of growing the schema.
+            Fields that already exist are replaced, so the profile can be re-applied to an existing core
+            (documents indexed before that keep their old settings until the next full reindex)."""
+        schema_url = self.solr_url + self.core + "/schema"
+        existing_fields = {field['name'] for field in requests.get(schema_url + "/fields").json()['fields']}
+        copy_fields = requests.get(schema_url + "/copyfields").json()['copyFields']
 
-    def add_fields(self):
         data = {
-            "add-field": [
-                {
-                    "name": "title",
-                    "type": "string",
-                    "indexed": True,
-                    "multiValued": False
-                },
-                {
-                    "name": "revision_id",
-                    "type": "string",
-                    "multiValued": False
-                },
-                {
-                    "name": "url",
-                    "type": "string",
-                    "multiValued": False
-                },
-                {
-                    "name": "summary",
-                    "type": "text_en",
-                    "indexed": True,
-                    "multiValued": False
-                },
-                {
-                    "name": "topic",
-                    "type": "string",
-                    "indexed": True,
-                    "multiValued": False
-                },
-            ]
+            "add-field": [field for field in SCHEMA_FIELDS if field['name'] not in existing_fields],
+            "replace-field": [field for field in SCHEMA_FIELDS if field['name'] in existing_fields],
         }
+        if not any(copy_field['source'] == 'title' and copy_field['dest'] == 'title_text' for copy_field in copy_fields):
+            data["add-copy-field"] = {"source": "title", "dest": "title_text"}
+        data = {command: value for command, value in data.items() if value}
+        print(requests.post(schema_url, json=data).json())
+
+        config = {"set-user-property": {"update.autoCreateFields": "false"}}
+        print(requests.post(self.solr_url + self.core + "/config", json=config).json())
+
+    def index_documents(self, docs, batch_size=1000, soft_commit_every=10, checkpoint_path=CHECKPOINT_FILE,
+                        resume=False):
+        """ Sends docs to Solr in batches of batch_size, with up to 2 * workers batches in flight.
+            A soft commit every soft_commit_every batches makes progress searchable, and a single hard commit at
+            the end persists the index. After every soft commit the number of docs acknowledged (in stream order)
+            is written to checkpoint_path; with resume=True those docs are skipped, so a failed run continues where
+            it stopped instead of starting over."""
+        skip = 0
+        if resume and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                skip = json.load(f)["indexed"]
+            print(f"Resuming after {skip} documents")
+
+        # Batches are acknowledged out of order; the checkpoint only covers the contiguous prefix that is done
+        done_upto, finished_ranges = skip, {}
+        indexed, batches_since_commit = 0, 0
+        in_flight = {}
+        start_time = time.time()
 
-        print(requests.post(self.solr_url + CORE_NAME + "/schema", json=data).json())
+        def collect(futures):
+            nonlocal done_upto, indexed, batches_since_commit
+            for future in futures:
+                first, count = in_flight.pop(future)
+                future.result()
+                finished_ranges[first] = count
+                while done_upto in finished_ranges:
+                    done_upto += finished_ranges.pop(done_upto)
+                indexed += count
+                batches_since_commit += 1
+            if batches_since_commit >= soft_commit_every:
+                self.commit(soft=True, checkpoint_path=checkpoint_path, done_upto=done_upto)
+                batches_since_commit = 0
+                rate = indexed / (time.time() - start_time)
+                print(f"Indexed {done_upto} documents ({rate:.0f} docs/s)")
 
-# Load the data from the json file
-file_name = CORPUS_FILE 
-with open(file_name) as f:
-    data = json.load(f)
+        position = skip
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch in iter_batches(islice(docs, skip, None), batch_size):
+                if len(in_flight) >= 2 * self.workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight[executor.submit(self.create_documents, batch)] = (position, len(batch))
+                position += len(batch)
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
 
-# Pad the data in the one that doesnt have 520 documents
-def pad_docs(docs, total_len, topic):
-    if len(docs) >= total_len:
-        return docs[:total_len]
-    else:
-        pad_data = [{'summary': '', 'revision_id': '', 'title': '', 'revision_id': '', topic: topic}] * (total_len - len(docs))
-        return docs + pad_data
+        self.commit(soft=False, checkpoint_path=checkpoint_path, done_upto=done_upto)
+        elapsed = time.time() - start_time
+        print(f"Indexed {indexed} documents in {elapsed:.1f}s ({indexed / elapsed if elapsed else 0.0:.0f} docs/s)")
+        return indexed
 
-padded_data_final = {}
-total_length = 5000 
-for topic, docs in data.items():
-    padded_data_final[str(topic)] = pad_docs(docs, total_length, topic)
+    def commit(self, soft, checkpoint_path, done_upto):
+        self.connection.commit(softCommit=soft)
+        # Soft-committed docs are already in Solr's update log, so they survive a restart once acknowledged
+        with open(checkpoint_path, 'w') as f:
+            json.dump({"indexed": done_upto}, f)
 
-df = pd.DataFrame(padded_data_final)
 
-i = Indexer()
-i.do_initial_setup()
-i.add_fields()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stream the combined Wikipedia corpus into Solr")
+    parser.add_argument('--corpus', default=CORPUS_FILE, help="Combined corpus ({topic: [doc, ...]})")
+    parser.add_argument('--core', default=CORE_NAME,
+                        help="Core to (re)create & fill, e.g. a second core to compare with benchmark_schema.py")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Documents per update request")
+    parser.add_argument('--workers', type=int, default=4, help="Update requests sent concurrently")
+    parser.add_argument('--soft-commit-every', type=int, default=10, help="Batches between soft commits")
+    parser.add_argument('--checkpoint', default=CHECKPOINT_FILE, help="Progress file used by --resume")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue a failed run from the checkpoint instead of recreating the core")
+    args = parser.parse_args()
 
-collection = df.to_dict('records')
-i.create_documents(collection)
+    i = Indexer(workers=args.workers, core=args.core)
+    if not args.resume:
+        i.do_initial_setup()
+        i.apply_schema_profile()
 
-solr_url_ = f'http://{VM_IP}:8983/solr/'
-connection_ = pysolr.Solr(solr_url_ + CORE_NAME, always_commit=True, timeout=5000000)
+    docs = to_solr_documents(iter_corpus(args.corpus))
+    i.index_documents(docs, batch_size=args.batch_size, soft_commit_every=args.soft_commit_every,
+                      checkpoint_path=args.checkpoint, resume=args.resume)
 
-# Query all documents
-res = connection_.search('*:*', )
-print(f"Total number of documents indexed: {len(res)}")
-for i in res:
-    print(i)
+    # Query all documents
+    res = i.connection.search('*:*', rows=0)
+    print(f"Total number of documents indexed: {res.hits}")
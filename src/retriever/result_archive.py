@@ -0,0 +1,139 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+
+class ResultArchiveWriter:
+    """ Append-only JSON Lines archive of served results, written by a background thread.
+        submit() only enqueues the record, so requests never wait on serialization or disk. The writer drains the
+        queue in batches (one write & flush per batch) and rotates the file once it grows past max_bytes, keeping
+        `backups` old files (path.1 is the newest). When the queue is full the record is dropped & counted instead
+        of slowing the request down."""
+    _STOP = object()
+
+    def __init__(self, path, max_queue=10000, batch_size=256, flush_interval=1.0, max_bytes=64 * 1024 * 1024,
+                 backups=5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self.written, self.dropped, self.batches, self.rotations, self.errors = 0, 0, 0, 0, 0
+
+        self._file = open(path, 'a', encoding='utf-8')
+        self._size = self._file.tell()
+        self._thread = threading.Thread(target=self._run, name='result-archive-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, record):
+        """ Queues one record for the archive. Returns False if it was dropped because the writer is behind."""
+        try:
+            self._queue.put_nowait((time.time(), record))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def close(self):
+        """ Writes out everything already queued & stops the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "queued": self._queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "rotations": self.rotations,
+                "errors": self.errors,
+                "bytes": self._size,
+            }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if self._STOP in batch:
+                stopping = True
+                batch = [item for item in batch if item is not self._STOP]
+            if batch:
+                self._write_batch(batch)
+        self._file.close()
+
+    def _write_batch(self, batch):
+        # A failed rotation may have left the archive closed; it is reopened before the next write
+        if self._file.closed and not self._reopen():
+            print(f"Could not archive {len(batch)} results: {self.path} is not open")
+            return
+        try:
+            data = ''.join(json.dumps({"timestamp": timestamp, **record}, separators=(',', ':')) + '\n'
+                           for timestamp, record in batch)
+            self._file.write(data)
+            self._file.flush()
+        except Exception as e:
+            print(f"Could not archive {len(batch)} results: {e}")
+            with self._lock:
+                self.errors += 1
+            return
+
+        with self._lock:
+            self.written += len(batch)
+            self.batches += 1
+            self._size += len(data.encode('utf-8'))
+        if self._size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        """ Shifts path -> path.1 -> ... -> path.<backups> & starts a new file. If a rename fails (permissions,
+            full disk, a backup held open elsewhere), the error is counted & writing continues in whatever file is
+            at path; the rotation is retried after the next batch."""
+        self._file.close()
+        try:
+            for index in range(self.backups - 1, 0, -1):
+                if os.path.exists(f'{self.path}.{index}'):
+                    os.replace(f'{self.path}.{index}', f'{self.path}.{index + 1}')
+            if self.backups > 0:
+                os.replace(self.path, f'{self.path}.1')
+            else:
+                os.remove(self.path)
+        except OSError as e:
+            print(f"Could not rotate {self.path}: {e}")
+            with self._lock:
+                self.errors += 1
+        else:
+            with self._lock:
+                self.rotations += 1
+        self._reopen()
+
+    def _reopen(self):
+        """ Opens path for appending; False (with the error counted) if it cannot be opened."""
+        try:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        except OSError as e:
+            print(f"Could not open {self.path}: {e}")
+            with self._lock:
+                self.errors += 1
+            return False
+        with self._lock:
+            self._size = self._file.tell()
+        return True
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+import aiohttp
+
+from query_builder import build_edismax_query, build_grouped_edismax_query
+from retriever import Retriever, VM_IP, CORE_NAME, GROUPING_RETRY_INTERVAL
+
+
+class SolrRequestError(Exception):
+    """ Solr answered with a non-200 status."""
+    def __init__(self, status, message):
+        super().__init__(f"Solr returned HTTP {status}: {message}")
+        self.status = status
+
+
+class AsyncRetriever:
+    """ asyncio counterpart of Retriever for the async server.
+        Every query goes over one shared aiohttp session, whose connector keeps at most pool_size keep-alive
+        connections to Solr open; callers beyond that wait for a free connection. Topics are fetched with one
+        grouped request, or concurrently with asyncio.gather when grouping is not available."""
+    def __init__(self, pool_size=20, connect_timeout=3.05, read_timeout=30):
+        self.core_url = f'http://{VM_IP}:8983/solr/{CORE_NAME}'
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.session = None
+        self.use_grouping = True
+        self.grouping_retry_at = 0.0
+
+        self.in_flight, self.peak_in_flight = 0, 0
+        self.requests, self.errors = 0, 0
+        self.total_request_time = 0.0
+
+    async def start(self):
+        # The session (and its connector) must be created inside the running event loop
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def _get(self, path, params):
+        params = {key: str(value) for key, value in params.items()}
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        request_start = time.perf_counter()
+        try:
+            async with self.session.get(f'{self.core_url}/{path}', params=params) as response:
+                if response.status != 200:
+                    raise SolrRequestError(response.status, await response.text())
+                return await response.json(content_type=None)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.requests += 1
+            self.total_request_time += time.perf_counter() - request_start
+
+    async def get_index_version(self):
+        results = await self._get('replication', {'command': 'indexversion', 'wt': 'json'})
+        return results.get('indexversion')
+
+    async def retrieve_docs(self, topics, query, k):
+        """ Same response as Retriever.retrieve_docs."""
+        if len(topics) > 1 and self.use_grouping and time.monotonic() >= self.grouping_retry_at:
+            try:
+                all_res = await self.retrieve_docs_grouped(topics, query, k)
+            except SolrRequestError as e:
+                print(f"Grouped retrieval unavailable, falling back to per-topic requests: {e}")
+                self.grouping_retry_at = time.monotonic() + GROUPING_RETRY_INTERVAL
+                all_res = await self._retrieve_per_topic(topics, query, k)
+        else:
+            all_res = await self._retrieve_per_topic(topics, query, k)
+
+        final_res = sum(all_res, [])
+        return {"results": final_res, "total_results": len(final_res)}
+
+    async def _retrieve_per_topic(self, topics, query, k):
+        return await asyncio.gather(*(self.retrieve_docs_single_topic(topic, query, k) for topic in topics))
+
+    async def retrieve_docs_grouped(self, topics, query, k):
+        results = await self._get('select', {**build_grouped_edismax_query(query, topics, k), 'wt': 'json'})
+        groups = {group['groupValue']: group['doclist']['docs'] for group in results['grouped']['topic']['groups']}
+        return [Retriever.format_results(groups.get(topic, [])) for topic in topics]
+
+    async def retrieve_docs_single_topic(self, topic, query, k):
+        results = await self._get('select', {**build_edismax_query(query, [topic], k), 'wt': 'json'})
+        return Retriever.format_results(results['response']['docs'])
+
+    def stats(self):
+        return {
+            "pool_size": self.pool_size,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "utilization": min(self.in_flight / self.pool_size, 1.0),
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_request_ms": 1000 * self.total_request_time / self.requests if self.requests else 0.0,
+        }
@@ -0,0 +1,213 @@
+""" asyncio serving mode of retriever_server.py (same endpoints & responses), run with
+        python async_retriever_server.py
+    Requests are handled on one event loop instead of one blocked Flask worker each, so the number of chat users
+    served at once is bounded by MAX_CONCURRENT_REQUESTS & the Solr connection pool, not by the worker count."""
+import asyncio
+import json
+import os
+import sys
+import time
+
+from aiohttp import web
+
+from async_retriever import AsyncRetriever
+from query_builder import cache_terms
+from retriever import plan_query_batch
+from query_cache import QueryResultCache
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from result_archive import ResultArchiveWriter
+
+PORT = 9999
+K = 5
+SOLR_POOL_SIZE = 50
+# Requests handled at once; further requests wait up to QUEUE_TIMEOUT seconds for a slot, then get a 503
+MAX_CONCURRENT_REQUESTS = 500
+QUEUE_TIMEOUT = 2
+# Upper bound on the whole request (cache lookup + all Solr calls), answered with a 504 when exceeded
+REQUEST_TIMEOUT = 10
+INDEX_VERSION_CHECK_INTERVAL = 30
+# Sub-queries of one /retriever_docs_batch request that are sent to Solr at the same time. Each one also takes a
+# request slot, so batches count towards MAX_CONCURRENT_REQUESTS like single queries
+BATCH_MAX_IN_FLIGHT = 16
+# Items accepted in one /retriever_docs_batch request
+BATCH_MAX_ITEMS = 1000
+# Browser origins allowed to call the server with credentials (comma-separated in RETRIEVER_CORS_ORIGINS);
+# other origins get no CORS headers, so their pages cannot read the responses
+CORS_ALLOWED_ORIGINS = set(filter(None, os.environ.get("RETRIEVER_CORS_ORIGINS", "http://34.68.123.1:3000").split(',')))
+
+retriever = AsyncRetriever(pool_size=SOLR_POOL_SIZE)
+# Invalidation is driven by watch_index_version below, so the cache never blocks the event loop on Solr
+results_cache = QueryResultCache(max_bytes=64 * 1024 * 1024, ttl=3600)
+# Only enqueues on the event loop; serialization & disk writes happen on the archive's own thread
+results_archive = ResultArchiveWriter('retriever_results.jsonl')
+request_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+server_stats = {"in_flight": 0, "rejected": 0, "timed_out": 0}
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    response = await handler(request)
+    # The allowed origin is echoed back, so caches must keep responses for different origins apart
+    response.headers['Vary'] = 'Origin'
+    origin = request.headers.get('Origin')
+    if origin in CORS_ALLOWED_ORIGINS:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Access-Control-Allow-Credentials'] = 'true'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    return response
+
+
+async def retrieve(query, topics):
+    cache_key = QueryResultCache.make_key(cache_terms(query), topics, K)
+    output_dict = results_cache.get(cache_key)
+    if output_dict is not None:
+        return output_dict, True
+    output_dict = await retriever.retrieve_docs(topics, query, K)
+    results_cache.put(cache_key, output_dict)
+    return output_dict, False
+
+
+async def preflight(request):
+    return web.Response(status=204)
+
+
+async def execute_query(request):
+    start_time = time.time()
+    body = await request.json()
+    query = body.get("query")
+    topics = body.get("topics", [])
+
+    if not query or not topics:
+        return web.json_response({"error": "Missing query or topics"}, status=400)
+
+    try:
+        await asyncio.wait_for(request_slots.acquire(), QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        server_stats["rejected"] += 1
+        return web.json_response({"error": "Retriever is overloaded, try again"}, status=503)
+
+    server_stats["in_flight"] += 1
+    try:
+        output_dict, cached = await asyncio.wait_for(retrieve(query, topics), REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        server_stats["timed_out"] += 1
+        return web.json_response({"error": "Retrieval timed out"}, status=504)
+    finally:
+        server_stats["in_flight"] -= 1
+        request_slots.release()
+
+    response = {"Response": output_dict, "time_taken": str(time.time() - start_time)}
+    results_archive.submit({"query": query, "topics": topics, "cached": cached, **response})
+    return web.json_response(response)
+
+
+async def execute_query_batch(request):
+    """ Same request & NDJSON stream as /retriever_docs_batch in retriever_server.py."""
+    body = await request.json()
+    items = body.get("queries", [])
+    if not isinstance(items, list):
+        return web.json_response({"error": "queries must be a list"}, status=400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return web.json_response({"error": f"At most {BATCH_MAX_ITEMS} queries per batch"}, status=413)
+    unique_queries, positions, errors = plan_query_batch(items, K)
+
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+
+    async def write_lines(key, payload):
+        await response.write(''.join(json.dumps({"index": index, "query": items[index]["query"], **payload}) + '\n'
+                                     for index in positions[key]).encode('utf-8'))
+
+    for index, error in errors:
+        await response.write((json.dumps({"index": index, "error": error}) + '\n').encode('utf-8'))
+
+    window = asyncio.Semaphore(BATCH_MAX_IN_FLIGHT)
+
+    async def run(key, query, topics, k):
+        output_dict = results_cache.get(key)
+        if output_dict is not None:
+            return key, {"Response": output_dict}
+        async with window:
+            try:
+                await asyncio.wait_for(request_slots.acquire(), QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                server_stats["rejected"] += 1
+                return key, {"error": "Retriever is overloaded, try again"}
+            server_stats["in_flight"] += 1
+            try:
+                output_dict = await asyncio.wait_for(retriever.retrieve_docs(topics, query, k), REQUEST_TIMEOUT)
+            except asyncio.TimeoutError:
+                server_stats["timed_out"] += 1
+                return key, {"error": "Retrieval timed out"}
+            except Exception as e:
+                return key, {"error": str(e)}
+            finally:
+                server_stats["in_flight"] -= 1
+                request_slots.release()
+        results_cache.put(key, output_dict)
+        return key, {"Response": output_dict}
+
+    for task in asyncio.as_completed([run(key, *query) for key, query in unique_queries.items()]):
+        key, payload = await task
+        await write_lines(key, payload)
+
+    await response.write_eof()
+    return response
+
+
+async def cache_stats(request):
+    return web.json_response(results_cache.stats())
+
+
+async def pool_stats(request):
+    return web.json_response({**retriever.stats(), "server": server_stats})
+
+
+async def archive_stats(request):
+    return web.json_response(results_archive.stats())
+
+
+async def cache_invalidate(request):
+    """ Call after reindexing the Solr core to drop cached results right away."""
+    results_cache.invalidate()
+    return web.json_response(results_cache.stats())
+
+
+async def watch_index_version(app):
+    while True:
+        try:
+            results_cache.observe_index_version(await retriever.get_index_version())
+        except Exception as e:
+            print(f"Could not read the Solr index version: {e}")
+        await asyncio.sleep(INDEX_VERSION_CHECK_INTERVAL)
+
+
+async def on_startup(app):
+    await retriever.start()
+    app['index_version_watcher'] = asyncio.create_task(watch_index_version(app))
+
+
+async def on_cleanup(app):
+    app['index_version_watcher'].cancel()
+    await retriever.close()
+    results_archive.close()
+
+
+def create_app():
+    app = web.Application(middlewares=[cors_middleware])
+    app.router.add_post('/retriever_docs', execute_query)
+    app.router.add_route('OPTIONS', '/retriever_docs', preflight)
+    app.router.add_post('/retriever_docs_batch', execute_query_batch)
+    app.router.add_get('/cache_stats', cache_stats)
+    app.router.add_get('/pool_stats', pool_stats)
+    app.router.add_get('/archive_stats', archive_stats)
+    app.router.add_post('/cache_invalidate', cache_invalidate)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host='0.0.0.0', port=PORT)
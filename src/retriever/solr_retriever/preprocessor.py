@@ -4,21 +4,36 @@ Institute: University at Buffalo
 '''
 
 import collections
-import nltk
-from nltk.stem import PorterStemmer
+import functools
 import re
-from nltk.corpus import stopwords
-from nltk.tokenize import WhitespaceTokenizer
-nltk.download('stopwords')
 from tqdm import tqdm
+from stopwords_en import STOP_WORDS
 import threading
 
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# Anything that is not a word character or whitespace is replaced by a space
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+STEM_CACHE_SIZE = 100000
+
+
 class Preprocessor:
-    def __init__(self):
-        self.stop_words = set(stopwords.words('english'))
-        self.ps = PorterStemmer()
+    def __init__(self, stem_cache_size=STEM_CACHE_SIZE):
+        self.stop_words = STOP_WORDS
+        self._ps = None
+        # The vocabulary is tiny compared to the number of tokens, so memoize stems by surface form
+        self.stem = functools.lru_cache(maxsize=stem_cache_size)(self._stem)
+
+    @property
+    def ps(self):
+        """ NLTK is only imported when the first word is stemmed, which keeps it out of service start-up."""
+        if self._ps is None:
+            from nltk.stem import PorterStemmer
+            self._ps = PorterStemmer()
+        return self._ps
+
+    def _stem(self, word):
+        return self.ps.stem(word)
 
     def get_doc_id(self, doc):
         """ Splits each line of the document, into doc_id & text.
@@ -34,29 +49,14 @@ class Preprocessor:
     def tokenizer(self, text):
         """ Implement logic to pre-process & tokenize document text.
             Write the code in such a way that it can be re-used for processing the user's query.
-            To be implemented."""
-        text = text.lower()
-        text = re.sub(r'[^\w\s]', ' ', text)
-
-        # White Space tokenization
-        text = text.strip()
-        tokens = text.split()
-
-        invalid_token_status = False
-
-        # Count white space between words
-        if any(word == '' or word == ' ' for word in tokens):
-            invalid_token_status = True
-            raise ValueError("Invalid token found (space or a blank token)")
-        
-        # Do not include stop words
-        tokens = [word for word in tokens if word not in self.stop_words]
-
-        # Performing Porters stemming
-        stemmer = PorterStemmer()
-        tokens = [stemmer.stem(word) for word in tokens]
-
-        return tokens
+            Lowercase, strip punctuation, whitespace split, drop stop words & Porter stem (through the stem cache)."""
+        stop_words = self.stop_words
+        stem = self.stem
+        return [stem(word) for word in PUNCTUATION_PATTERN.sub(' ', text.lower()).split() if word not in stop_words]
+
+    def tokenize_batch(self, texts):
+        """ Tokenizes a list of texts in one call, sharing the compiled pattern & stem cache."""
+        return [self.tokenizer(text) for text in texts]
     
     def read_file_content(self, file_path):
         try:
@@ -81,12 +81,8 @@ class Preprocessor:
         queries = []
         original_queries = []
         if content:
-            split_content = content.split("\n")
-            
-            for index, line in enumerate(split_content):
-                if line.strip():
-                    queries.append(self.tokenizer(line))
-                    original_queries.append(line)
+            original_queries = [line for line in content.split("\n") if line.strip()]
+            queries = self.tokenize_batch(original_queries)
                 
         return queries, original_queries
 
@@ -0,0 +1,67 @@
+""" Builds Solr requests from the raw user question.
+    Solr's text_en chain (stop words, possessives, Porter stemming) analyzes the question at query time, exactly as it
+    analyzed the documents, so no client-side NLTK normalization is needed for the Solr engine. Client-side
+    normalization (Preprocessor) is only for the DaaT engine, which has no analysis of its own."""
+import re
+
+# Anything that is not a word character or whitespace is dropped, so user text can never form Lucene syntax
+# (field queries, boolean operators, wildcards, unbalanced quotes or brackets)
+SPECIAL_CHARACTERS = re.compile(r'[^\w\s]')
+
+# Fields searched (qf) with boosts: a match in the title counts more than one in the summary
+QUERY_FIELDS = 'summary title_text^2'
+# Docs containing the question's terms next to each other (as a phrase) are boosted on top
+PHRASE_FIELDS = 'summary^2 title_text^4'
+PHRASE_SLOP = 2
+# Minimum should match: all terms of 1-2 term questions, all but one of 3-5 terms, 60% of longer ones
+MINIMUM_MATCH = '2<-1 5<60%'
+
+
+def sanitize(text):
+    """ Plain lowercased words of the question, separated by single spaces."""
+    return ' '.join(SPECIAL_CHARACTERS.sub(' ', text.lower()).split())
+
+
+def topic_filter(topics):
+    """ fq clause matching any of topics (quoted, so topics with spaces work)."""
+    quoted = ['"{}"'.format(topic.replace('\\', '\\\\').replace('"', '\\"')) for topic in topics]
+    if len(quoted) == 1:
+        return f'topic:{quoted[0]}'
+    return 'topic:({})'.format(' OR '.join(quoted))
+
+
+def build_edismax_query(text, topics, k):
+    """ Solr select parameters for the top-k documents of each of topics: an edismax query over QUERY_FIELDS
+        with a phrase boost & a minimum-should-match, filtered on the topics. Field queries in the user text are
+        disabled (uf), so the whole question is free text."""
+    return {
+        'q': sanitize(text),
+        'defType': 'edismax',
+        'qf': QUERY_FIELDS,
+        'pf': PHRASE_FIELDS,
+        'ps': PHRASE_SLOP,
+        'mm': MINIMUM_MATCH,
+        'uf': '-*',
+        'q.alt': '-*:*',
+        'fq': topic_filter(topics),
+        'fl': '*,score',
+        'rows': k,
+    }
+
+
+def build_grouped_edismax_query(text, topics, k):
+    """ Same query for several topics in one request, grouped by topic with the top-k of each group."""
+    query = build_edismax_query(text, topics, k)
+    query.update({
+        'group': 'true',
+        'group.field': 'topic',
+        'group.limit': k,
+        'rows': len(topics),
+    })
+    return query
+
+
+def cache_terms(text):
+    """ Cache key part of a question: questions differing only in case, punctuation or spacing share results."""
+    return sanitize(text).split()
+
@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryResultCache:
+    """ LRU cache of retriever responses keyed on (normalized query terms, topics, k).
+        Topics keep their request order, since responses list the results topic by topic in that order.
+        Entries expire after ttl seconds and the cache is bounded by the approximate JSON size of the cached
+        responses (max_bytes). Lookups never touch Solr: the servers poll the index version in the background &
+        report it through observe_index_version, which invalidates the cache when it changes (e.g. after a reindex)."""
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits, self.misses, self.evictions, self.invalidations = 0, 0, 0, 0
+        self._index_version = None
+
+    @staticmethod
+    def make_key(query_terms, topics, k):
+        if isinstance(query_terms, str):
+            query_terms = query_terms.split()
+        return tuple(query_terms), tuple(topics), k
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.invalidations += 1
+
+    def observe_index_version(self, index_version):
+        """ Records the current Solr index version & drops every entry if it changed since the last observation.
+            Called by the servers' index version watchers."""
+        if self._index_version is not None and index_version != self._index_version:
+            self.invalidate()
+        self._index_version = index_version
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "index_version": self._index_version,
+            }
+
+    def _remove(self, key):
+        value, size, expires_at = self._entries.pop(key)
+        self.current_bytes -= size
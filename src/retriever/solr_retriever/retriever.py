@@ -2,43 +2,73 @@
 # coding: utf-8
 import pysolr
 import json
+import time
 
 VM_IP = '34.130.33.83'
 CORE_NAME = "IRF24P3"
+# Seconds to wait before trying grouped multi-topic requests again after Solr rejected one
+GROUPING_RETRY_INTERVAL = 300
 
 
-# Import NLTK
 import collections
-import nltk
-from nltk.stem import PorterStemmer
 import re
-from nltk.corpus import stopwords
-from nltk.data import find
-from nltk.tokenize import WhitespaceTokenizer
 
 from tqdm import tqdm
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from preprocessor import Preprocessor
+from query_builder import build_edismax_query, build_grouped_edismax_query, cache_terms
+from query_cache import QueryResultCache
+from solr_pool import SolrConnectionPool
+
+def plan_query_batch(items, default_k, max_k=100):
+    """ Validates a batch of {query, topics, k} items in one pass & merges identical sub-queries.
+        Returns (unique_queries, positions, errors): unique_queries maps each cache key to (query, topics, k),
+        positions maps it to the indexes of the items asking for it & errors lists (index, message) of bad items."""
+    unique_queries, positions, errors = {}, {}, []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get("query") or not item.get("topics"):
+            errors.append((index, "Missing query or topics"))
+            continue
+        query, topics, k = item["query"], item["topics"], item.get("k", default_k)
+        if not isinstance(query, str):
+            errors.append((index, "query must be a string"))
+            continue
+        if not isinstance(topics, list) or not all(isinstance(topic, str) for topic in topics):
+            errors.append((index, "topics must be a list of strings"))
+            continue
+        # bool is an int subclass, but {"k": true} is not a meaningful result count
+        if isinstance(k, bool) or not isinstance(k, int) or not 1 <= k <= max_k:
+            errors.append((index, f"k must be an integer between 1 and {max_k}"))
+            continue
+
+        key = QueryResultCache.make_key(cache_terms(query), topics, k)
+        if key not in unique_queries:
+            unique_queries[key] = (query, topics, k)
+            positions[key] = []
+        positions[key].append(index)
+    return unique_queries, positions, errors
 
-def download_nltk_resource(resource):
-    try:
-        # check if resource already downloaded else go for downloading
-        find(f'corpora/{resource}')
-    except LookupError:
-        print(f'Downloading {resource}...')
-        nltk.download(resource)
-        print(f'{resource} downloaded successfully')
-    else:
-        print(f'{resource} already downloaded')
-
-
-download_nltk_resource('stopwords')
 
 class Retriever():
-    def __init__(self):
-        self.preprocessor = Preprocessor()
+    def __init__(self, pool_size=20):
+        self._preprocessor = None
         self.solr_url_ = f'http://{VM_IP}:8983/solr/'
+        # One keep-alive connection pool for every query & topic, instead of a new pysolr.Solr per call
+        self.solr_pool = SolrConnectionPool(self.solr_url_ + CORE_NAME, pool_size=pool_size)
+        self.use_grouping = True
+        self.grouping_retry_at = 0.0
+        # Used for the concurrent per-topic fallback when result grouping is not available
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
     
+    @property
+    def preprocessor(self):
+        """ Only needed for query_normalizer (client-side normalization for the DaaT engine), so created on first use;
+            Solr queries are built from the raw question (see query_builder)."""
+        if self._preprocessor is None:
+            self._preprocessor = Preprocessor()
+        return self._preprocessor
+
     def query_normalizer(self, queries):
         original_queries = queries
         queries = [[element] for element in queries]
@@ -59,37 +89,35 @@ class Retriever():
     
         return normalized_queries, original_queries
 
-    def retrieve_docs(self, topics, query_string, k):
-        all_res = []
-        for topic in topics:
-            all_res.append(self.retrieve_docs_single_topic(topic, query_string, k))
+    def get_index_version(self):
+        """ Version of the Solr index, changes whenever the core is reindexed (used to invalidate cached results)."""
+        return self.solr_pool.get('replication', command='indexversion', wt='json').get('indexversion')
+
+    def retrieve_docs(self, topics, query, k):
+        """ Top-k documents per topic for the user's question (raw text, analyzed by Solr). Several topics are fetched
+            with one grouped Solr request (group.field=topic, group.limit=k); if grouping fails the topics are
+            queried concurrently instead."""
+        if len(topics) > 1 and self.use_grouping and time.monotonic() >= self.grouping_retry_at:
+            try:
+                all_res = self.retrieve_docs_grouped(topics, query, k)
+            except pysolr.SolrError as e:
+                print(f"Grouped retrieval unavailable, falling back to per-topic requests: {e}")
+                # Do not retry grouping on every request while it is failing
+                self.grouping_retry_at = time.monotonic() + GROUPING_RETRY_INTERVAL
+                all_res = list(self.executor.map(lambda topic: self.retrieve_docs_single_topic(topic, query, k), topics))
+        elif len(topics) > 1:
+            all_res = list(self.executor.map(lambda topic: self.retrieve_docs_single_topic(topic, query, k), topics))
+        else:
+            all_res = [self.retrieve_docs_single_topic(topic, query, k) for topic in topics]
     
         # Flatten the all_res into one single list (it is multi-dim initially)
         final_res = sum(all_res, [])
         response_dict = {"results": final_res, "total_results": len(final_res) }
         return response_dict
-    
-    def retrieve_docs_single_topic(self, topic, query_string, k):
-        connection_ = pysolr.Solr(self.solr_url_ + CORE_NAME, always_commit=True, timeout=5000000)
 
-        print('QUERY STRING inside Retrieve_docs_single_topic',query_string)
-        # if multiple terms then we need to OR them and give it (AND will be very strict search)
-        if isinstance(query_string, list):
-            query_string = ' OR '.join(query_string)
-    
-        print(query_string)
-    
-        query = {
-            'q': query_string,
-            'fq': f'topic:{topic}',
-            'df': 'summary',
-            'rows': k,
-            'fl': '*,score'
-        }
-        
-        results = connection_.search(**query)
-        print(f"Total documents matching query: {len(results)}")
-        
+    @staticmethod
+    def format_results(results):
+        """ Keeps the fields returned to the UI & drops duplicate titles."""
         res_list = []
         res_title = set()
         for result in results:
@@ -102,31 +130,28 @@ class Retriever():
             if res_dict["title"] not in res_title:
                 res_title.add(res_dict["title"])
                 res_list.append(res_dict)
-    
         return res_list
 
+    def retrieve_docs_grouped(self, topics, query, k):
+        """ One Solr request for all topics: filter on any of the topics & group the hits by topic (top-k per group).
+            Returns one result list per topic, in the order of topics."""
+        results = self.solr_pool.search(**build_grouped_edismax_query(query, topics, k))
+        groups = {group['groupValue']: group['doclist']['docs'] for group in results.grouped['topic']['groups']}
+        return [self.format_results(groups.get(topic, [])) for topic in topics]
+    
+    def retrieve_docs_single_topic(self, topic, query, k):
+        results = self.solr_pool.search(**build_edismax_query(query, [topic], k))
+        print(f"Total documents matching query: {len(results)}")
+    
+        return self.format_results(results)
+
 
 if __name__ == '__main__':
     retriever = Retriever()
-    
 
-    topic = "Travel"
-    query_string  = "What is cryptocurrency coronavirus"
-    norm_query, orig_query = retriever.query_normalizer([query_string])
-
-    # Make the query into one single list and flatten since it is 2-D.
-    norm_query = sum(norm_query, [])
-    res_list = retriever.retrieve_docs_single_topic("Politics", norm_query, 5)
+    res_list = retriever.retrieve_docs_single_topic("Politics", "What is cryptocurrency coronavirus", 5)
     len(res_list)
     print(res_list)
 
-    query_string  = "the novel coronavirus"
-    preprocessor = Preprocessor()
-    norm_query, orig_query = retriever.query_normalizer([query_string])
-    
-    # Make the query into one single list and flatten since it is 2-D.
-    norm_query = sum(norm_query, [])
-    
-    res_list = retriever.retrieve_docs(["Politics", "Health"], norm_query, 5)
+    res_list = retriever.retrieve_docs(["Politics", "Health"], "the novel coronavirus", 5)
     print(res_list)
-
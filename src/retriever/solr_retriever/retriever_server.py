@@ -1,16 +1,50 @@
+import json
+import os
+import sys
+import threading
 import time
-from flask import Flask, request, jsonify
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import Flask, request, jsonify, Response, stream_with_context
 import hashlib
-import json
-from retriever import Retriever
+from retriever import Retriever, plan_query_batch
+from query_builder import cache_terms
+from query_cache import QueryResultCache
 from flask_cors import CORS
 
+# result_archive.py is shared with the DaaT server & lives one level up
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from result_archive import ResultArchiveWriter
+
 app = Flask(__name__)
+K = 5
+# Sub-queries of one /retriever_docs_batch request that are sent to Solr at the same time
+BATCH_MAX_IN_FLIGHT = 16
+# Items accepted in one /retriever_docs_batch request
+BATCH_MAX_ITEMS = 1000
+INDEX_VERSION_CHECK_INTERVAL = 30
 
 CORS(app,  supports_credentials=True)
 
 retriever = Retriever()
-backup_res_output_file = 'retriever_results.json'
+# Served results are archived by a background thread, off the request path
+results_archive = ResultArchiveWriter('retriever_results.jsonl')
+# Chat users repeat the same questions over the same topics, so identical requests are served from memory
+# Invalidation is driven by watch_index_version below, so a lookup never waits on Solr
+results_cache = QueryResultCache(max_bytes=64 * 1024 * 1024, ttl=3600)
+# Separate from retriever.executor, which retrieve_docs itself uses for per-topic requests
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_IN_FLIGHT)
+
+def watch_index_version():
+    """ Polls the Solr index version every INDEX_VERSION_CHECK_INTERVAL seconds, so cached results are dropped after
+        a reindex."""
+    while True:
+        try:
+            results_cache.observe_index_version(retriever.get_index_version())
+        except Exception as e:
+            print(f"Could not read the Solr index version: {e}")
+        time.sleep(INDEX_VERSION_CHECK_INTERVAL)
+
+threading.Thread(target=watch_index_version, name='index-version-watcher', daemon=True).start()
 
 @app.route("/retriever_docs", methods=['POST', 'OPTIONS'])
 def execute_query():
@@ -24,7 +58,6 @@ def execute_query():
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
         return response, 204
     start_time = time.time()
-    K=5
 
     print(request.json)
     query = request.json.get("query")
@@ -33,26 +66,94 @@ def execute_query():
     if not query or not topics:
         return jsonify({"error": "Missing query or topics"}), 400
 
-    query_terms = []
-    normalized_query, original_query = retriever.query_normalizer([query])
-    print("FROM SERVER, PRINTING normalzied query")
-    print(normalized_query, original_query)
-
-    normalized_query = [term for sublist in normalized_query for term in sublist]
+    # Solr analyzes the raw question itself (see query_builder), so there is no client-side normalization here
+    cache_key = QueryResultCache.make_key(cache_terms(query), topics, K)
+    output_dict = results_cache.get(cache_key)
+    if output_dict is not None:
+        response = {"Response": output_dict, "time_taken": str(time.time() - start_time)}
+        results_archive.submit({"query": query, "topics": topics, "cached": True, **response})
+        return jsonify(response)
 
     """ Running the queries against the pre-loaded index. """
-    output_dict = retriever.retrieve_docs(topics, normalized_query, 5)
+    output_dict = retriever.retrieve_docs(topics, query, K)
+    results_cache.put(cache_key, output_dict)
 
     response = {
         "Response": output_dict,
         "time_taken": str(time.time() - start_time),
     }
 
-    """ Dumping the results to a JSON file. """
-    with open(backup_res_output_file, 'w') as fp:
-        json.dump(response, fp, sort_keys=True, indent=4)
+    results_archive.submit({"query": query, "topics": topics, "cached": False, **response})
+
+    return jsonify(response)
+
+@app.route("/retriever_docs_batch", methods=['POST'])
+def execute_query_batch():
+    """ Body: {"queries": [{"query": str, "topics": [str, ...], "k": int (optional, default 5)}, ...]}
+        Streams one JSON line per item as soon as its results are ready (so not in request order):
+        {"index": position in queries, "query": str, "Response": {...}} or {"index": ..., "error": str}.
+        Identical sub-queries (same words, topics & k) are sent to Solr once and answered from the cache where possible."""
+    items = request.json.get("queries", [])
+    if not isinstance(items, list):
+        return jsonify({"error": "queries must be a list"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_MAX_ITEMS} queries per batch"}), 413
+    unique_queries, positions, errors = plan_query_batch(items, K)
+
+    def lines_for(key, payload):
+        for index in positions[key]:
+            yield json.dumps({"index": index, "query": items[index]["query"], **payload}) + '\n'
+
+    def generate():
+        for index, error in errors:
+            yield json.dumps({"index": index, "error": error}) + '\n'
+
+        in_flight = {}
+
+        def finished(futures):
+            for future in futures:
+                key = in_flight.pop(future)
+                try:
+                    output_dict = future.result()
+                except Exception as e:
+                    yield from lines_for(key, {"error": str(e)})
+                    continue
+                results_cache.put(key, output_dict)
+                yield from lines_for(key, {"Response": output_dict})
+
+        for key, (query, topics, k) in unique_queries.items():
+            output_dict = results_cache.get(key)
+            if output_dict is not None:
+                yield from lines_for(key, {"Response": output_dict})
+                continue
+            if len(in_flight) >= BATCH_MAX_IN_FLIGHT:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+            in_flight[batch_executor.submit(retriever.retrieve_docs, topics, query, k)] = key
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            yield from finished(done)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route("/cache_stats", methods=['GET'])
+def cache_stats():
+    return jsonify(results_cache.stats())
+
+@app.route("/pool_stats", methods=['GET'])
+def pool_stats():
+    return jsonify(retriever.solr_pool.stats())
+
+@app.route("/archive_stats", methods=['GET'])
+def archive_stats():
+    return jsonify(results_archive.stats())
 
-    return flask.jsonify(response)
+@app.route("/cache_invalidate", methods=['POST'])
+def cache_invalidate():
+    """ Call after reindexing the Solr core to drop cached results right away."""
+    results_cache.invalidate()
+    return jsonify(results_cache.stats())
 
 if __name__ == "__main__":
     #retriever = Retriever()
@@ -19,14 +19,11 @@ import collections
 import nltk
 from nltk.stem import PorterStemmer
 import re
-from nltk.corpus import stopwords
 from nltk.tokenize import WhitespaceTokenizer
-nltk.download('stopwords')
 from tqdm import tqdm
+from stopwords_en import STOP_WORDS
 import threading
 
-nltk.download()
-nltk.download('stopwords')
 
 
 # In[3]:
@@ -37,7 +34,7 @@ nltk.download('stopwords')
 
 class Preprocessor:
     def __init__(self):
-        self.stop_words = set(stopwords.words('english'))
+        self.stop_words = STOP_WORDS
         self.ps = PorterStemmer()
 
     def get_doc_id(self, doc):
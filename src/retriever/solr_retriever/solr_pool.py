@@ -0,0 +1,80 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import pysolr
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class SolrConnectionPool:
+    """ Shared keep-alive connections to one Solr core.
+        A single requests.Session with a bounded urllib3 pool is handed to pysolr, so TCP connections are reused
+        across queries instead of being set up per topic. Idempotent requests are retried with exponential backoff
+        and usage is tracked for the /pool_stats endpoint."""
+    def __init__(self, core_url, pool_size=20, connect_timeout=3.05, read_timeout=30, retries=3, backoff_factor=0.3):
+        self.core_url = core_url
+        self.pool_size = pool_size
+
+        retry = Retry(total=retries, connect=retries, read=retries, backoff_factor=backoff_factor,
+                      status_forcelist=(502, 503, 504), allowed_methods=frozenset(['GET', 'HEAD']))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.connection = pysolr.Solr(core_url, session=self.session, timeout=self.timeout)
+
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self.in_use, self.peak_in_use = 0, 0
+        self.requests, self.errors = 0, 0
+        self.total_wait_time, self.total_request_time = 0.0, 0.0
+
+    @contextmanager
+    def acquire(self):
+        """ Holds one of the pool_size slots for the duration of a request."""
+        wait_start = time.perf_counter()
+        self._slots.acquire()
+        request_start = time.perf_counter()
+        with self._lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.total_wait_time += request_start - wait_start
+        try:
+            yield self.connection
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_use -= 1
+                self.requests += 1
+                self.total_request_time += time.perf_counter() - request_start
+            self._slots.release()
+
+    def search(self, **query):
+        with self.acquire() as connection:
+            return connection.search(**query)
+
+    def get(self, path, **params):
+        """ Plain GET against the core (e.g. admin handlers) over the pooled session."""
+        with self.acquire():
+            response = self.session.get(f'{self.core_url}/{path}', params=params, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "utilization": self.in_use / self.pool_size,
+                "requests": self.requests,
+                "errors": self.errors,
+                "avg_wait_ms": 1000 * self.total_wait_time / self.requests if self.requests else 0.0,
+                "avg_request_ms": 1000 * self.total_request_time / self.requests if self.requests else 0.0,
+            }
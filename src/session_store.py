@@ -0,0 +1,128 @@
+import threading
+from collections import OrderedDict
+
+
+class SessionStore:
+    """ Conversation history (token ids) per chat session, replacing the single global history shared by every user.
+        At most max_sessions histories are kept; the least recently used session is evicted first. Each history is
+        capped at max_history_tokens by dropping the oldest turns, so it always starts at a turn boundary.
+        A history over the cap is cut down to low_water_tokens (half the cap by default) rather than just under the
+        cap. Cutting shifts every position, so the cached keys/values of the session have to be re-encoded; with the
+        margin that happens once every few turns instead of on every turn of a long conversation, at the price of
+        the model seeing less context right after a cut."""
+    def __init__(self, eos_token_id, max_sessions=1000, max_history_tokens=872, low_water_tokens=None):
+        self.eos_token_id = eos_token_id
+        self.max_sessions = max_sessions
+        self.max_history_tokens = max_history_tokens
+        self.low_water_tokens = low_water_tokens or max_history_tokens // 2
+
+        self._histories = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id):
+        """ Token ids of the session's conversation so far ([] for a new session)."""
+        with self._lock:
+            history = self._histories.get(session_id)
+            if history is None:
+                return []
+            self._histories.move_to_end(session_id)
+            return history
+
+    def put(self, session_id, history):
+        history = self.truncate(history)
+        with self._lock:
+            self._histories[session_id] = history
+            self._histories.move_to_end(session_id)
+            while len(self._histories) > self.max_sessions:
+                self._histories.popitem(last=False)
+                self.evictions += 1
+
+    def reset(self, session_id):
+        with self._lock:
+            self._histories.pop(session_id, None)
+
+    def truncate(self, history):
+        """ Returns history unchanged while it fits in max_history_tokens, otherwise the most recent turns that fit
+            in low_water_tokens (every turn ends with the eos token). If the newest turn alone is longer than that,
+            as much of it as fits in max_history_tokens is kept."""
+        if len(history) <= self.max_history_tokens:
+            return list(history)
+        for limit in (self.low_water_tokens, self.max_history_tokens):
+            if history[-limit - 1] == self.eos_token_id:
+                return list(history[-limit:])
+            window = history[-limit:]
+            try:
+                # Drop the partial turn left at the start of the window
+                return list(window[window.index(self.eos_token_id, 0, len(window) - 1) + 1:])
+            except ValueError:
+                continue
+        return list(history[-self.max_history_tokens:])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._histories),
+                "max_sessions": self.max_sessions,
+                "max_history_tokens": self.max_history_tokens,
+                "low_water_tokens": self.low_water_tokens,
+                "history_tokens": sum(len(history) for history in self._histories.values()),
+                "evictions": self.evictions,
+            }
+
+
+class KVCacheStore:
+    """ The model's attention keys/values (past_key_values, legacy tuple format) per session, so a new turn only has
+        to encode its own tokens. Each entry records the token ids it covers; it is only reused while those ids are
+        still the start of the session's history. Entries are evicted least recently used first once their total
+        size exceeds max_bytes (an evicted session is simply re-encoded on its next turn)."""
+    def __init__(self, max_bytes=2 * 1024 ** 3):
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def get(self, session_id, history):
+        """ (past_key_values, number of history tokens they cover), or (None, 0) if nothing reusable is cached."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or history[:len(entry[0])] != entry[0]:
+                self.misses += 1
+                return None, 0
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry[1], len(entry[0])
+
+    def put(self, session_id, token_ids, past_key_values):
+        size = sum(tensor.numel() * tensor.element_size() for layer in past_key_values for tensor in layer)
+        with self._lock:
+            self._remove(session_id)
+            if size > self.max_bytes:
+                return
+            self._entries[session_id] = (list(token_ids), past_key_values, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def drop(self, session_id):
+        with self._lock:
+            self._remove(session_id)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "sessions": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, session_id):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]